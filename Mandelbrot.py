@@ -7,89 +7,80 @@
 #
 ############################################################
 #
-# COMPLEX OR REAL CALCULATIONS?
+# MANDELBROT VIEWER
 #
-# Python's ability to process Complex Numbers is so fast that
-# there is little benefit to using the Mandelbrot algorithm for
-# the Real Plane (see Wikipedia article on the Mandelbrot Set).
-# Using the Complex version also has the benefit of underlying
-# the algorithm's simplicity
+# Console menu and Pygame view window. All calculation and
+# coloring is done by MandelbrotEngine which can also be
+# imported on its own. Pygame is only loaded when a view
+# window is actually opened, so headless use never needs it.
+# See MandelbrotEngine for notes about coordinates.
 #
-# NOTE ABOUT COORDINATES
+# NOTE ABOUT THE ZOOM PREVIEW
 #
-# View coordinates in the Complex plane are floating-point
-# numbers. The Real part (X) increases towards the right and
-# the Imaginary part (Y) increases towards the top. The view
-# rectangle is specified by CENTER coordinates, width and
-# height (X,Y,W,H).
+# While a zoom rectangle is shown, a small inset in the corner
+# away from it previews the area under it at low resolution
+# and depth. Previews are calculated on a background thread
+# which only ever works on the latest request: older requests
+# waiting are replaced and one being calculated is abandoned
+# as soon as a newer one is made. Each finished preview is
+# announced to the event loop with a USEREVENT.
 #
-# Screen coordinates are in integer pixels relative to (0,0)
-# at the top left of the window. The X value increases towards
-# the right of the screen BUT the Y value increases towards
-# the bottom. The zoom rectangle consists of the screen
-# coordinates of the starting and end points of the zoom drag.
-# When both coordinates are identical, this implies a zoom
-# rectangle width and height of ONE (zero widths and heights
-# are not possible in this instance).
+# NOTE ABOUT THE RENDER CACHE
+#
+# The maps of the last CACHE_VIEWS views calculated are kept,
+# as compact arrays, so that returning to a view is instant.
+# With --prefetch the time the view window spends waiting for
+# the user is used to calculate likely next views into the
+# cache: the zoom area once drawn, the area under the cursor
+# zoomed in 4x, the quadrants of the view and the points of
+# interest. Prefetch work is abandoned as soon as any event
+# arrives. A zoom into part of a cached view is previewed
+# straight away from the cached map while the new view is
+# calculated.
+#
+# NOTE ABOUT THE JULIA PANEL
+#
+# Pressing J widens the window with a panel showing the Julia
+# set for c at the mouse position. As the mouse moves, the
+# Julia set is drawn at 1/8 resolution and low depth, which
+# is quick enough to follow the mouse. Once the mouse pauses
+# for JULIA_PAUSE it is refined, step by step, to the full
+# resolution and depth. Refining is abandoned as soon as any
+# event arrives.
 
 ############################################################
 # IMPORTS
 ############################################################
 
-import pygame; from pygame.locals import *
-import sys, os
-from math import *
-from colorsys import *
+import sys, os, argparse, time, json, threading
+from collections import OrderedDict
+from decimal import Decimal
+from MandelbrotEngine import *
+from MandelbrotKernels import GetKernel, SelectKernel, KERNELS, VECTORISED
+from MandelbrotKernels import EstimateTime, LearnRate, FmtSecs, Throughput
+
+pygame = None               # Loaded by InitViewWindow()
 
 ############################################################
 # CONSTANTS
 ############################################################
 
-MAX_DEPTH   = 256           # Max Mandelbrot iterations
-SW          = 600           # Screen Width
-SH          = 400           # Screen Height
-AR          = SW/SH         # Aspect Ratio
-
-PRECISION   = 0.01          # Compaction precision (1%)
-MAX_DP       = 16           # Max decimal places used
-
-REF_X       = -0.75         # Start X coordinate
-REF_Y       = 0.0           # Start Y coordinate
-MIN_WIDTH   = 1E-15         # Minimum view width
-MAX_WIDTH   = 4.5           # Maximum view width
-MIN_HEIGHT  = MIN_WIDTH/AR  # Minimum view height
-MAX_HEIGHT  = MAX_WIDTH/AR  # Maximum view height
-
-MIN_X = REF_X - MAX_WIDTH/2
-MAX_X = REF_X + MAX_WIDTH/2
-MIN_Y = REF_Y - MAX_HEIGHT/2
-MAX_Y = REF_Y + MAX_HEIGHT/2
-
-ALL_EVENTS = [ QUIT, MOUSEBUTTONDOWN, MOUSEBUTTONUP, MOUSEMOTION ]
-
-WORLDVIEW = [REF_X, REF_Y, MAX_WIDTH, MAX_HEIGHT]
-
-VIEW0 = [-0.090,          0.964,          0.165,          0.110       ]
-VIEW1 = [-1.25079,        0.02242,        0.00065,        0.00043     ]
-VIEW2 = [-0.7698,         0.1095,         0.0042,         0.0028 ]
-VIEW3 = [-0.74627,        0.12041,        0.00039,        0.00026     ]
-VIEW4 = [0.3231,          -0.0354,        0.0092,         0.0061      ]
-VIEW5 = [-1.94081,        0.00088,        0.00082,        0.00055     ]
-VIEW6 = [-0.5261,         0.5067,         0.0216,         0.0144      ]
-VIEW7 = [0.35496,         0.34629,        0.00028,        0.00019     ]
-VIEW8 = [-1.7491005,      0.0003483,      0.0000255,      0.0000170   ]
-VIEW9 = [-1.785693031,    0.000000869,    0.000000315,    0.000000210 ]
-
-DESC0   = "Thorny Branches"
-DESC1   = "Exotic Island"
-DESC2   = "Jelly Fish"
-DESC3   = "Sea Horses"
-DESC4   = "Fan of Elephants"
-DESC5   = "Spindly Bug"
-DESC6   = "Potted Plants"
-DESC7   = "Claw Spiral"
-DESC8   = "Spiky Tail"
-DESC9   = "Brocolli Junction"
+ALL_EVENTS = [ "QUIT", "MOUSEBUTTONDOWN", "MOUSEBUTTONUP", "MOUSEMOTION", "KEYDOWN",
+               "USEREVENT" ]
+
+INSET       = (SW//4, SH//4)    # Zoom preview size
+INSET_DEPTH = MAX_DEPTH//4      # Zoom preview max iterations
+INSET_GAP   = 4                 # Zoom preview distance from edges
+
+CACHE_VIEWS = 32                # Max views in render cache
+
+PREFETCH_STRIP = 0.01           # Prefetch time per strip (secs)
+PREFETCH_PAUSE = 0.3            # Mouse rest before prefetching under it (secs)
+
+JULIA_SIZE  = (SH, SH)              # Julia panel size
+JULIA_VIEW  = [0.0, 0.0, 4.0, 4.0]  # Julia panel view
+JULIA_STEPS = [8, 4, 2, 1]          # Julia panel resolution divisors
+JULIA_PAUSE = 0.2                   # Mouse pause before refining (secs)
         
 ############################################################
 # Global Variables
@@ -103,10 +94,48 @@ Quitting    = False     # Quitting program itself
 
 Palette     = None      # Color palette
 Map         = None      # Two dimensional screen map
+Mapping     = "CLIP"    # Palette balancing method
+Gradient    = "GREY"    # Palette color gradient
+Clip        = CLIP      # Palette tail clip (%)
+Kernel      = "python"  # Kernel used to calculate views
+Depth       = MAX_DEPTH # Max Mandelbrot iterations of views
+Indexed     = False     # Skip areas proven uniform (see MandelbrotIndex)
+Resumable   = False     # Checkpoint views (see MandelbrotCheckpoint)
+Adaptive    = False     # Depth chosen per tile (see MandelbrotAdaptive)
 
 Surface     = None      # Display surface
 Image       = None      # Currently displayed image
 
+Timing      = False     # Report timings on console
+FrameTimes  = []        # Drag update times of last drag (secs)
+Steps       = []        # Timings of each view calculated (see StartStep)
+
+Recording   = None      # File recording events (see RecordEvent)
+RecordFile  = None      # Name of file to record events to
+IdleSince   = 0.0       # Time last event finished being handled
+
+Inset       = None      # Zoom preview image (see RequestInset)
+InsetMap    = None      # Zoom preview Mandelbrot values
+InsetPos    = None      # Zoom preview position on Surface
+InsetCount  = 0         # Number of latest zoom preview request
+InsetLock   = None      # Guards InsetJob and InsetDone
+InsetJob    = None      # Zoom preview waiting to be calculated
+InsetDone   = None      # Zoom preview last calculated
+
+Cache       = OrderedDict() # Render cache of maps by view (LRU)
+Prefetching = False     # Calculate likely views when idle
+Cursor      = None      # Last mouse position in view window
+CursorMoved = 0.0       # Time mouse last moved in view window
+
+Julia       = False     # Julia panel shown (J key)
+JuliaC      = None      # c of Julia set in panel
+JuliaMap    = None      # Julia panel Mandelbrot values
+JuliaStep   = 0         # Index of JULIA_STEPS in Julia panel
+JuliaImage  = None      # Julia panel image
+JuliaMoved  = 0.0       # Time JuliaC last changed
+
+Estimates   = {}        # Estimated render times of menu views
+
 ############################################################
 # FUNCTIONS
 ############################################################
@@ -130,20 +159,20 @@ def InitMenu():
     print("Q: Quit")
     print("H: Help")
     print("C: Custom Coordinates")
-    print("W: World View (default)")
+    print("W: World View (default)    " + MenuEstimate(WORLDVIEW))
     print()
     print("Points of Interest")
     print("------------------")
-    print("0: " + DESC0)
-    print("1: " + DESC1)
-    print("2: " + DESC2)
-    print("3: " + DESC3)
-    print("4: " + DESC4)
-    print("5: " + DESC5)
-    print("6: " + DESC6)
-    print("7: " + DESC7)
-    print("8: " + DESC8)
-    print("9: " + DESC9)
+    print("0: " + format(DESC0, "23s") + MenuEstimate(VIEW0))
+    print("1: " + format(DESC1, "23s") + MenuEstimate(VIEW1))
+    print("2: " + format(DESC2, "23s") + MenuEstimate(VIEW2))
+    print("3: " + format(DESC3, "23s") + MenuEstimate(VIEW3))
+    print("4: " + format(DESC4, "23s") + MenuEstimate(VIEW4))
+    print("5: " + format(DESC5, "23s") + MenuEstimate(VIEW5))
+    print("6: " + format(DESC6, "23s") + MenuEstimate(VIEW6))
+    print("7: " + format(DESC7, "23s") + MenuEstimate(VIEW7))
+    print("8: " + format(DESC8, "23s") + MenuEstimate(VIEW8))
+    print("9: " + format(DESC9, "23s") + MenuEstimate(VIEW9))
     print("-----------------------------------------------------------------")
     
     a = input("Enter Option: ")
@@ -193,6 +222,20 @@ def InitMenu():
 
 ############################################################
 
+def MenuEstimate(view):
+
+    # Returns the estimated render time of a menu view. Each
+    # view is only estimated once per kernel.
+
+    key = (Kernel, tuple(view))
+
+    if key not in Estimates:
+        Estimates[key] = FmtSecs(EstimateTime(view, Kernel, max_d = Depth))
+
+    return Estimates[key]
+
+############################################################
+
 def HelpMenu():
 
     while True:
@@ -202,7 +245,7 @@ def HelpMenu():
         print("1: The Magic Equation")
         print("2: How to Zoom")
         print("3: Performance and Detail")
-        print("4: Why Greyscale?")
+        print("4: Colors")
         print()
         print("X: Exit Help (default)")
         print("-----------------------------------------------------------------")        
@@ -264,6 +307,16 @@ def Help2():
     print()
     print("To clear the zoom area, simply click outside it. It will also be")
     print("cleared if you attempt to zoom beyond the zoom limit.")
+    print()
+    print("While the zoom area is shown, a quick preview of it appears in")
+    print("the opposite corner of the window, with its estimated time in")
+    print("the window caption, so dull areas can be skipped.")
+    print()
+    print("Press M, G or C to change the color mapping, gradient or clip.")
+    print("Colors change instantly without recalculating the view.")
+    print()
+    print("Press J to show or hide the Julia set for the point under the")
+    print("mouse in a panel to the right of the view.")
     print("-----------------------------------------------------------------")
     input("Press ENTER to continue")
     print()
@@ -288,10 +341,12 @@ def Help3():
     print("program's ability to process very high-precision floating-point")
     print("numbers at speed. By keeping the display window small and using")
     print("colors efficiently, this program is able to generate reasonable")
-    print("detail using a Maximum Iterations Count = " + str(MAX_DEPTH) + ".")
+    print("detail using a Maximum Iterations Count = " + str(Depth) + ".")
     print()
     print("A new view is typically rendered in less than a minute although")
-    print("this will increase in darker regions.")
+    print("this will increase in darker regions. The estimated time for")
+    print("each view is shown in the main menu, and in the window caption")
+    print("for a zoom rectangle.")
     print("-----------------------------------------------------------------")
     input("Press ENTER to continue")
     print()
@@ -301,17 +356,24 @@ def Help3():
 def Help4():
 
     print("-----------------------------------------------------------------")
-    print("Why Greyscale?")
+    print("Colors")
     print("-----------------------------------------------------------------")
     print("The color representation of the values produced by the Mandelbrot")
-    print("algorithm is the most subjective aspect. Using the full color")
-    print("spectrum with sophisticated post-processing can yield impressive")
-    print("results but it takes from the one-dimensional purity, especially")
-    print("at low Maximum Iteration counts.")
+    print("algorithm is the most subjective aspect. Greyscale keeps to the")
+    print("one-dimensional purity of the values, especially at low Maximum")
+    print("Iteration counts, but the colors of a view can be changed at any")
+    print("time without calculating it again:")
     print()
-    print("Dynamic greyscale color balancing is also employed to show the")
-    print("maximum detail for any given view. The overall result is a good")
-    print("compromise between speed and detail")
+    print("  G: Color gradient (" + ", ".join(GRADIENTS) + ")")
+    print("  M: Color mapping (" + ", ".join(MAPPINGS) + ")")
+    print("  C: Clip of CLIP mapping (" + ", ".join(format(c, "g") + "%" for c in CLIPS) + ")")
+    print()
+    print("Dynamic color balancing is employed to show the maximum detail")
+    print("for any given view. CLIP spreads the values linearly over the")
+    print("gradient, ignoring the rarest values at either end. EQUALISE gives")
+    print("each color an equal share of the pixels. The same choices can be")
+    print("made for images generated without a window with --gradient,")
+    print("--mapping and --clip.")
     print("-----------------------------------------------------------------")
     input("Press ENTER to continue")
     print()
@@ -335,6 +397,9 @@ def GetCoordinates():
     # Generate height automatically
         
     h,dp = Compact(w/AR)
+
+    print("Estimate   =", FmtSecs(EstimateTime([x,y,w,h], Kernel, max_d = Depth)))
+    print()
         
     return x,y,w,h
 
@@ -378,35 +443,22 @@ def InitViewVars():
     # Initialises all view variables except ViewRect which
     # will have been generated by the initial menu
 
-    global ZoomRect, Dragging, Closing, Quitting
+    global ZoomRect, Dragging, Closing, Quitting, Julia, JuliaImage
 
     ZoomRect = None
     Dragging = False
     Closing = False
     Quitting = False
+    Julia = False
+    JuliaImage = None
 
-    InitPalette()
-    InitMap()
-
-############################################################
-
-def InitViewWindow():
-
-    global Surface, Image
-    
-    if sys.platform == 'win32' or sys.platform == 'win64':
-        os.environ['SDL_VIDEO_CENTERED'] = '1'
+    # A zoom preview may be left from a window closed while
+    # it was shown
 
-    pygame.init()
-    
-    icon = pygame.Surface((1,1))
-    icon.set_alpha(0)
-    pygame.display.set_icon(icon)
+    CancelInset()
 
-    EnableEvents(ALL_EVENTS)
-    
-    Surface = pygame.display.set_mode((SW,SH))
-    Image = pygame.Surface((SW,SH))
+    InitMap()
+    InitPalette()
 
 ############################################################
 
@@ -414,121 +466,81 @@ def InitMap():
 
     global Map
 
-    Map = [[0] * SH for x in range(SW)]
+    Map = NewMap()
 
 ############################################################
 
 def InitPalette():
 
-    # Sets up standard colors, initialises balanced colors
-    # to match standard colors and sets pixel counts to zero.
-    # Currently using a linear greyscale from white to black. 
-
     global Palette
 
-    Palette = [None] * MAX_DEPTH
-
-    pix = 0
-    
-    for m in range(MAX_DEPTH):
-
-        v = round(255*m/(MAX_DEPTH-1))
-
-        r = 255 - v
-        g = 255 - v
-        b = 255 - v
-
-        std = [r,g,b]
-        bal = std
-
-        Palette[m] = [std, bal, pix]
+    Palette = MakePalette(Map, Mapping, Gradient, Clip, Depth)
 
 ############################################################
 
-def ClearPalette():
-
-    # Clears all pixel counts in palette
+def InitViewWindow():
 
-    global Palette
+    # Loads Pygame on first use so that the engine and the
+    # headless path never pay for importing it
 
-    for m in range(MAX_DEPTH):
-        Palette[m][2] = 0
+    global Surface, Image, pygame
 
-############################################################
+    import pygame
+    
+    if sys.platform == 'win32' or sys.platform == 'win64':
+        os.environ['SDL_VIDEO_CENTERED'] = '1'
 
-def BalancePalette():
+    pygame.init()
+    
+    icon = pygame.Surface((1,1))
+    icon.set_alpha(0)
+    pygame.display.set_icon(icon)
 
-    # Balance/re-balance color palette based on pixel counts
-    # already generated for each Mandelbrot value during Pass
-    # One of Calc(). Balancing is achieved by identifying the
-    # minimum and maximum Mandelbrot values which account for
-    # 98% of all pixels on the screen i.e at least 1% are below
-    # min threshold and at least 1% are above max threshold.
-    # Ignoring 2% of pixels at either extreme reveals enough
-    # detail at either extreme while preventing tiny hot spots
-    # from skewing the color balance. The min and max values
-    # thus obtained are then used to calculate offset and gain
-    # parameters for generating balanced colors. The objective
-    # is to give the most efficient and informative visual
-    # representation for any given view within normal computing
-    # constraints. 
+    EnableEvents(ALL_EVENTS)
+    
+    Surface = pygame.display.set_mode((SW,SH))
+    Image = pygame.Surface((SW,SH))
 
-    global Palette
+    StartInsetWorker()
 
-    max_d = MAX_DEPTH
-    pixels = SW * SH
-    
-    min_thresh = pixels/100     # 2.5%
-    max_thresh = pixels/100     # 2.5%
+############################################################
 
-    min_pixels = 0
-    max_pixels = 0
-  
-    for m in range(0, MAX_DEPTH, 1):
+def Recolor():
 
-        min_m = m
-        min_pixels += Palette[m][2]
-        
-        if min_pixels >= min_thresh:
-            break
+    # Rebuilds the palette for the current Mapping, Gradient
+    # and Clip from the Mandelbrot values already held in Map
+    # and re-renders the image. No Mandelbrot values are
+    # recalculated so this takes milliseconds rather than the
+    # seconds or minutes needed by Calc().
 
-    for m in range(MAX_DEPTH-1, -1, -1):
+    InitPalette()
+    Render()
 
-        max_m = m
-        max_pixels += Palette[m][2]
-        
-        if max_pixels >= max_thresh:
-            break
-   
-    # Calculate offset and gain that will render
-    # Mandelbrot values using full palette range 
+############################################################
 
-    if max_m == min_m:
-        offset = 0
-        gain   = 1.0
-    else:
-        offset = min_m
-        gain   = (max_d-1)/(max_m - min_m)
-   
-    # Now update palette balanced colors
+def Render():
 
-    for m in range(0, MAX_DEPTH, 1):
+    # PASS TWO - RENDER MANDELBROT VALUES
+    #
+    # Renders Map to Image using the balanced palette colors.
+    # Does nothing in headless mode where there is no Image.
 
-        b = int(gain * (m - offset))
-        if b < 0: b = 0
-        if b >= max_d: b = max_d - 1
-        
-        Palette[m][1] = Palette[b][0]
+    if Image == None:
+        return
 
+    rgb = RenderBytes(Map, Palette)
+    Image.blit(pygame.image.frombuffer(rgb, (SW,SH), "RGB"), (0,0))
 
 ############################################################
 
 def EnableEvents(events):
 
-    # Enables only the events listed and cleares event queue
+    # Enables only the events listed by name and clears
+    # event queue. Note that set_allowed(None) would allow
+    # ALL events, so everything is blocked first.
     
-    pygame.event.set_allowed(None)
-    pygame.event.set_allowed(events)
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed([getattr(pygame, e) for e in events])
     pygame.event.clear()
 
 ############################################################
@@ -541,98 +553,74 @@ def Calc():
     
     PrintView()
 
-    # This is computationally-intensive, so use
-    # pre-calculated local variables for efficiency
+    # PASS ONE - CALCULATE MANDELBROT VALUES
 
-    max_d = MAX_DEPTH
+    # Only allow Window QUIT events while calculating
     
-    sw = SW
-    sh = SH
-
-    # Get complex coordinates at top left of screen
-    # noting that y axis have opposite directions
+    if Surface != None:
+        EnableEvents(["QUIT"])
 
-    cw = ViewRect[2]
-    ch = ViewRect[3]
-    cx = ViewRect[0] - cw/2
-    cy = ViewRect[1] + ch/2
+    m_map = CacheGet(ViewRect)
 
-    # Clear pixel counts in Palette
+    if m_map == None:
 
-    ClearPalette()
+        if Surface != None: PreviewFromCache()
 
-    # PASS ONE - CALCULATE MANDELBROT VALUES
-   
-    sx_percent = 100/sw
-    progress = 0.0
+        m_map = CalcView(ViewRect, Depth, CalcProgress)
 
-    # Only allow Window QUIT events while calculating
-    
-    EnableEvents(QUIT)
-   
-    for sx in range(sw):
-
-        # When each column is completed, this is a good time
-        # to check for a window close attempt. Polling events
-        # is also necessary to give Pygame a chance to respond
-        # internally to operating system events such as windows
-        # move. This is also a good time to update progress
-        # indicator and increment the percent count. This adds
-        # about 10% overhead for the fastest calculations in the
-        # lightest regions. But this figure approaches 0% in the
-        # darkest regions where calculation time really matters.
-
-        if pygame.event.poll().type != NOEVENT:
+        if m_map == None:
+            if Resumable:
+                from MandelbrotCheckpoint import CheckpointPath
+                path = CheckpointPath(ViewRect, SW, SH, Depth)
+                print("Checkpoint saved to", path)
+                print("Resume with: --resume", path, "--output FILE")
+                print("-----------------------------------------------------------------")
             Closing = True
             return
 
-        pygame.display.set_caption("Calculating " +format(progress,".2f")+"%")
-        progress += sx_percent
-
-        for sy in range(sh):
-        
-            re = cx + cw*(sx/sw)
-            im = cy - ch*(sy/sh)
-            
-            z = complex(re,im)
-            c = z
-            
-            for m in range(max_d):
-                z = z*z + c
-                if abs(z) >= 2.0: break
-
-            # Save value for Pass Two
+        CachePut(ViewRect, m_map)
 
-            Map[sx][sy] = m
+    Map = m_map
 
-            # Update palette pixel count for this value
-            
-            Palette[m][2] += 1
+    # Re-balance palette colors using pixel counts of the
+    # values generated in Pass One. These will be used for
+    # rendering in Pass Two
 
-        #endfor
+    InitPalette()
 
-    #endfor
+    # PASS TWO - RENDER MANDELBROT VALUES
 
-    # Re-balance palette colors using pixel counts generated
-    # in Pass One. These will be used for rendering in Pass Two
+    Render()
 
-    BalancePalette()
+    if Surface != None:
+        EnableEvents(ALL_EVENTS)
+        SetReadyCaption()
 
-    # PASS TWO - RENDER MANDELBROT VALUES
+############################################################
 
-    for sx in range(sw):
+def CalcProgress(percent):
+
+    # Called by the kernel before each column (or strip of
+    # columns). When each column is completed, this is a good
+    # time to check for a window close attempt. Polling events
+    # is also necessary to give Pygame a chance to respond
+    # internally to operating system events such as windows
+    # move. This is also a good time to update progress
+    # indicator. This adds about 10% overhead for the fastest
+    # calculations in the lightest regions. But this figure
+    # approaches 0% in the darkest regions where calculation
+    # time really matters.
+    # Returns False to abandon calculation.
+
+    if Surface == None:
+        return True
 
-        for sy in range(sh):
-            
-            m = Map[sx][sy]
-            Image.set_at((sx,sy),Palette[m][1])
-            
-        #endfor
+    if pygame.event.poll().type != pygame.NOEVENT:
+        return False
 
-    #endfor
+    pygame.display.set_caption("Calculating " +format(percent,".2f")+"%")
 
-    EnableEvents(ALL_EVENTS)
-    pygame.display.set_caption("Ready")
+    return True
 
 ############################################################
 
@@ -650,125 +638,22 @@ def Draw():
     if ZoomRect != None:
         rect = RelRect(NormRect(ZoomRect))
         pygame.draw.rect(Surface,(255,0,0),rect,1)
-   
-    pygame.display.flip()
-
-############################################################
-
-def AbsRect(r):
-
-    # Converts a screen rectangle in the form (x,y,w,h)
-    # to one with absolute coordinates (x1,y1,x2,y2).
-    # Note that widths and heights must be non-zero and
-    # positive. A width and height of 1 pixel will
-    # produce identical start and end coordinates 
-
-    x1 = r[0]
-    x2 = r[0] + r[2] - 1
-   
-    y1 = r[1]
-    y2 = r[1] + r[3] - 1
-    
-    return (x1,y1,x2,y2)
-
-############################################################
-
-def RelRect(r):
 
-    # Converts a screen rectangle in the form (x1,y1,x2,y2)
-    # to one with relative coordinates (x,y,w,h). Note that
-    # identical start and end coordinates will produce a
-    # width and height of 1 pixel. Input rectangle must be
-    # normalised.
+    PlaceInset()
+    DrawInset()
 
-    x1 = r[0]
-    w = r[2] - r[0] + 1
+    if Julia and JuliaImage != None:
+        Surface.blit(JuliaImage,(SW,0))
    
-    y1 = r[1]
-    h = r[3] - r[1] + 1
-    
-    return (x1,y1,w,h)
-
-############################################################
-
-def NormRect(r):
-
-    # Normalises a rectangle with absolute coordinates so that
-    # the returned x1,y1 coordinates are less than x2,y2.
-
-    x1 = r[0]
-    y1 = r[1]
-    x2 = r[2]
-    y2 = r[3]
-
-    if x1 > x2:
-        x1,x2 = x2,x1
-
-    if y1 > y2:
-        y1,y2 = y2,y1
-        
-    return (x1,y1,x2,y2)
-
-############################################################
-
-def Compact(r):
-
-    # Converts raw floating point number into most compact
-    # decimal form that meets the required precision. Also
-    # returns number of decimal places used.
-
-    if r == 0.0:
-        return r,0
-    elif r < 0:
-        neg = True
-    else:
-        neg = False
-
-    r = abs(r)
-
-    dp = -floor(log10(r))
-
-    while True:
-        
-        c = round(r,dp)
-        
-        if abs((c-r)/r) <= PRECISION:
-            break
-        
-        dp = dp + 1
-        
-        if dp > MAX_DP:
-            c = r
-            dp = MAX_DP
-            break
-
-    if neg: c = -c
-    
-    return c, dp
- 
-############################################################
-
-def CompactView():
-
-    # Returns compacted version of view coordinates using
-    # maximum precision required across all 4 values
-    
-    vx,vy,vw,vh = ViewRect
-
-    cx,dpx = Compact(vx)
-    cy,dpy = Compact(vy)
-    cw,dpw = Compact(vw)
-    ch,dph = Compact(vh)
-
-    maxdp = max([dpx,dpy,dpw,dph])
+    pygame.display.flip()
 
-    return [FmtDp(v,maxdp) for v in ViewRect]
+    MarkTime("preview")
 
 ############################################################
 
 def PrintView():
 
-    x,y,w,h = CompactView()
+    x,y,w,h = CompactView(ViewRect, ViewDp(ViewRect))
    
     print("Center X = ", x)
     print("Center Y = ", y)
@@ -778,18 +663,6 @@ def PrintView():
 
 ############################################################
 
-def FmtDp(f,dp = None):
-
-    # Formats floating point value with indicated decimal
-    # or MAX_DP if dp argument is not supplied
-        
-    if dp == None:
-        dp = MAX_DP
-
-    return format(f," ." + str(dp) + "f")
-
-############################################################
-
 def WithinZoomRect(x,y):
 
     # Returns True if x,y location is within zoom rectangle
@@ -808,38 +681,15 @@ def Zoom():
     # Generates new view based on zoom rectangle which is
     # subsequently cleared. Zooming full screen or beyond
     # the zoom limit will retain the current view while
-    # clearing the zoom reactangle. Because the zoom
-    # rectangle is integer based, it may have slight
-    # aspect-ratio errors. For critical floating point
-    # calculations, derive height from width using the
-    # global aspect-ratio.
+    # clearing the zoom reactangle.
 
     global ViewRect, ZoomRect
 
-    # Map ZoomRect to ViewRect coordinate system
-    # which is centered with y increasing upwards
-
-    rz = RelRect(NormRect(ZoomRect))
-  
-    rx,ry,rw,rh = [float(r) for r in rz]
-    
-    zw = rw
-    zh = rw/AR
-    zx = rx - SW/2 + zw/2 
-    zy = -(ry - SH/2 + zh/2)
-
-    # Can now generate new view using simple scaling
+    CancelInset()
 
-    vx,vy,vw,vh = ViewRect
+    new_rect = ZoomView(ViewRect, ZoomRect)
 
-    nx = vx + vw*zx/SW
-    ny = vy + vh*zy/SH
-    nw = vw*zw/SW
-    nh = nw/AR
-
-    new_rect = [nx,ny,nw,nh]
-
-    if nw < MIN_WIDTH:
+    if new_rect[2] < MIN_WIDTH:
         
         print("Zoom Limit")
         print("-----------------------------------------------------------------")
@@ -847,12 +697,41 @@ def Zoom():
     elif new_rect != ViewRect:
 
         ViewRect = new_rect
+        StartStep()
         Calc()
 
     #endif
 
     ZoomRect = None
     Draw()
+    SetReadyCaption()
+
+    MarkTime("final")
+
+############################################################
+
+def StartStep():
+
+    # Starts timing a new view. Each step records the view,
+    # the drag frame times of the zoom rectangle that led to
+    # it and, as they happen, the time to the first display
+    # update showing the new view ("preview") and to the
+    # finished image ("final").
+
+    Steps.append({"view": list(ViewRect), "frames": list(FrameTimes),
+                  "start": time.perf_counter()})
+
+############################################################
+
+def MarkTime(name):
+
+    # Records the time since the current step started under
+    # name, unless already recorded or the step is finished
+
+    if len(Steps) == 0 or "final" in Steps[-1] or name in Steps[-1]:
+        return
+
+    Steps[-1][name] = time.perf_counter() - Steps[-1]["start"]
 
 ############################################################
 
@@ -862,6 +741,9 @@ def StartDrag(mx,my):
 
     Dragging = True
     ZoomRect = [ mx, my, mx, my ]
+
+    FrameTimes.clear()
+    CancelInset()
     
     Draw()
 
@@ -895,8 +777,67 @@ def UpdateDrag(mx,my):
 
     x2 = x1 + w - 1 if mx >= x1 else x1 - w + 1
 
+    start = time.perf_counter()
+
+    old_rect = ZoomRect
     ZoomRect = [x1,y1,x2,y2]
-    Draw()
+    DrawZoomChange(old_rect)
+
+    FrameTimes.append(time.perf_counter() - start)
+
+    RequestInset()
+
+############################################################
+
+def SetZoomCaption(secs = None):
+
+    # Shows the estimated render time of the zoom rectangle
+    # in the window caption, estimating it now if not given.
+    # While dragging, estimates are given by the zoom preview
+    # (see InsetEstimate) so as not to hold up the drag.
+
+    if secs == None:
+        secs = EstimateTime(ZoomView(ViewRect, ZoomRect), Kernel, max_d = Depth)
+
+    pygame.display.set_caption("Zoom (" + FmtSecs(secs) + ")")
+
+############################################################
+
+def DrawZoomChange(old_rect):
+
+    # Redraws only what changes when the zoom rectangle moves
+    # during dragging. The old outline is restored from Image
+    # and the new outline drawn over it, then only the strips
+    # covered by both outlines are pushed to the display. This
+    # is far cheaper than Draw() which blits and flips the
+    # whole window. The zoom preview is kept on top and moved
+    # if the zoom rectangle has crossed into its corner.
+
+    old_strips = OutlineStrips(old_rect)
+    new_strips = OutlineStrips(ZoomRect)
+
+    for r in old_strips:
+        Surface.blit(Image, r, r)
+
+    inset_rects = PlaceInset()
+
+    pygame.draw.rect(Surface,(255,0,0),RelRect(NormRect(ZoomRect)),1)
+
+    DrawInset()
+
+    pygame.display.update(old_strips + new_strips + inset_rects)
+
+############################################################
+
+def OutlineStrips(r):
+
+    # Returns the four one pixel wide strips (x,y,w,h) that
+    # make up the outline of an absolute zoom rectangle
+
+    x,y,w,h = RelRect(NormRect(r))
+
+    return [(x, y, w, 1), (x, y+h-1, w, 1),
+            (x, y, 1, h), (x+w-1, y, 1, h)]
 
 ############################################################
 
@@ -906,6 +847,25 @@ def EndDrag():
     
     Dragging = False
     Draw()
+    SetZoomCaption()
+
+    if Timing: PrintFrameTimes()
+
+############################################################
+
+def PrintFrameTimes():
+
+    # Reports drag update times of the last drag
+
+    if len(FrameTimes) == 0:
+        return
+
+    ms = sorted([t*1000 for t in FrameTimes])
+
+    print("Drag frames = ", len(ms))
+    print("Mean (ms)   = ", format(sum(ms)/len(ms), ".3f"))
+    print("Max (ms)    = ", format(ms[-1], ".3f"))
+    print("-----------------------------------------------------------------")
 
 ############################################################
 
@@ -914,70 +874,723 @@ def ClearZoomRect():
     global ZoomRect
 
     ZoomRect = None
+    CancelInset()
     Draw()
+    SetReadyCaption()
     
 ############################################################
 
-def GetEvent():
+def CacheGet(view):
 
-    # Awaits OS and mouse event for view window. Sleeps
-    # while waiting so as not to hog CPU. Allowed events
-    # are pre-filtered to minimise wasteful processing.
-    # Events are processed one at a time as they arrive
-    # off the event queue.
-    
-    global Closing
+    # Returns the cached map of a view, or None
 
-    event = pygame.event.wait()
-       
-    if event.type == QUIT:
-        Closing = True
-        return
+    key = tuple(view)
 
-    mx, my = pygame.mouse.get_pos()
+    if key not in Cache:
+        return None
 
-    if event.type == MOUSEBUTTONDOWN and event.button == 1:
+    Cache.move_to_end(key)
 
-        if ZoomRect == None:
-            StartDrag(mx,my) 
-        else:
-            if WithinZoomRect(mx,my):
-                Zoom()
-            else:
-                ClearZoomRect()
-        return
+    return MapFromArray(Cache[key], SW, SH)
 
-    if event.type == MOUSEMOTION:
-                    
-        if Dragging: UpdateDrag(mx,my)   
-        return
+############################################################
 
-    if event.type == MOUSEBUTTONUP and event.button == 1:
+def CachePut(view, m_map):
 
-        if Dragging: EndDrag()
-        return
+    Cache[tuple(view)] = MapToArray(m_map)
+
+    while len(Cache) > CACHE_VIEWS:
+        Cache.popitem(last = False)
 
 ############################################################
 
-def ViewLoop():
+def PreviewFromCache():
 
-    # Initialises view-related variables and opens view window.
-    # Generates initial Mandelbrot view and then waits for and
-    # processes window events repeatedly until window is closed.
+    # Shows the current view straight away, at whatever
+    # detail the narrowest cached view containing it can
+    # give, while the view is being calculated
 
-    print("-----------------------------------------------------------------")
-    print("Generating Initial View")
-    print("-----------------------------------------------------------------")
+    global Map
 
-    InitViewVars()
-    InitViewWindow()
+    x,y,w,h = ViewRect
 
-    Calc()
-    Draw()
+    best = None
 
-    while not Closing: GetEvent()
+    for (cx,cy,cw,ch), data in Cache.items():
+        if (cx - cw/2 <= x - w/2 and x + w/2 <= cx + cw/2 and
+            cy - ch/2 <= y - h/2 and y + h/2 <= cy + ch/2):
+            if best == None or cw < best[0][2]:
+                best = [(cx,cy,cw,ch), data]
 
-    pygame.quit()
+    if best == None:
+        return
+
+    (cx,cy,cw,ch), data = best
+
+    left = x - w/2 - (cx - cw/2)
+    top  = (cy + ch/2) - (y + h/2)
+
+    cols = [min(SW-1, int((left + w*sx/SW)*SW/cw)) for sx in range(SW)]
+    rows = [min(SH-1, int((top + h*sy/SH)*SH/ch)) for sy in range(SH)]
+
+    Map = [[data[c*SH + r] for r in rows] for c in cols]
+
+    InitPalette()
+    Render()
+
+    Surface.blit(Image,(0,0))
+    pygame.display.flip()
+
+    MarkTime("preview")
+
+    if Timing:
+        print("Previewed from cached view of width", format(cw, ".4g"))
+
+############################################################
+
+def Prefetch():
+
+    # Calculates likely next views into the render cache, in
+    # the same way as Calc() but without checkpoints, until
+    # they are all cached or an event arrives. Kernels work
+    # in strips of PREFETCH_STRIP rather than JOB_SECS
+    # meanwhile, so that events are not kept waiting for long.
+
+    import MandelbrotKernels
+
+    types = [getattr(pygame, e) for e in ALL_EVENTS]
+
+    def idle(percent):
+        return not pygame.event.peek(types)
+
+    MandelbrotKernels.StripSecs = PREFETCH_STRIP
+
+    try:
+        for view in PrefetchViews():
+
+            if not idle(0):
+                return
+
+            if tuple(view) in Cache:
+                continue
+
+            m_map = CalcView(view, Depth, idle, checkpoint = False)
+
+            if m_map == None:
+                return
+
+            CachePut(view, m_map)
+
+            if Timing:
+                print("Prefetched view of width", format(view[2], ".4g"))
+
+        #endfor
+    finally:
+        MandelbrotKernels.StripSecs = MandelbrotKernels.JOB_SECS
+
+############################################################
+
+def PrefetchViews():
+
+    # Returns likely next views, most likely first. Nothing
+    # is worth prefetching while dragging, and the view under
+    # the mouse only once it has rested (see PrefetchWait).
+
+    if Dragging:
+        return []
+
+    views = []
+
+    if ZoomRect != None:
+        views.append(ZoomView(ViewRect, ZoomRect))
+
+    if Cursor != None and PrefetchWait() == None:
+        mx = min(max(Cursor[0], SW//8), SW - SW//8)
+        my = min(max(Cursor[1], SH//8), SH - SH//8)
+        views.append(ZoomView(ViewRect, [mx - SW//8, my - SH//8,
+                                         mx + SW//8 - 1, my + SH//8 - 1]))
+
+    for qx in (0, SW//2):
+        for qy in (0, SH//2):
+            views.append(ZoomView(ViewRect, [qx, qy, qx + SW//2 - 1, qy + SH//2 - 1]))
+
+    return views + [WORLDVIEW] + VIEWS
+
+############################################################
+
+def PrefetchWait():
+
+    # Returns milliseconds to wait for events before the
+    # mouse has rested for PREFETCH_PAUSE, so that the view
+    # under it can be prefetched, or None if it has (or
+    # nothing is being prefetched)
+
+    if not Prefetching or Dragging or Cursor == None:
+        return None
+
+    wait = PREFETCH_PAUSE - (time.perf_counter() - CursorMoved)
+
+    return max(1, round(wait*1000)) if wait > 0 else None
+
+############################################################
+
+def StartInsetWorker():
+
+    # Starts the background thread that calculates zoom
+    # previews. It is only started once and lives on for
+    # later view windows.
+
+    global InsetLock
+
+    if InsetLock != None:
+        return
+
+    InsetLock = threading.Condition()
+
+    threading.Thread(target = InsetWorker, daemon = True).start()
+
+############################################################
+
+def InsetWorker():
+
+    # Runs on the background thread. Waits for a zoom preview
+    # request, calculates it with the current kernel (unless
+    # that is the very slow precise kernel), estimates the
+    # render time of the zoom area from it and posts a
+    # USEREVENT when done. The calculation is abandoned as
+    # soon as a newer request is made.
+
+    global InsetJob, InsetDone
+
+    iw,ih = INSET
+
+    while True:
+
+        with InsetLock:
+            while InsetJob == None:
+                InsetLock.wait()
+            n, view = InsetJob
+            InsetJob = None
+
+        m_map = PreviewKernel()(view, iw, ih, INSET_DEPTH, lambda percent: n == InsetCount)
+
+        if m_map == None or n != InsetCount:
+            continue
+
+        secs = InsetEstimate(m_map)
+
+        with InsetLock:
+            InsetDone = [n, m_map, secs]
+
+        try:
+            pygame.event.post(pygame.event.Event(pygame.USEREVENT))
+        except pygame.error:
+            pass
+
+############################################################
+
+def InsetEstimate(m_map):
+
+    # Returns the estimated render time of a view from its
+    # zoom preview. Escape counts do not depend on the depth,
+    # so pixels that escaped in the preview take the same
+    # iterations in the view. Pixels that did not escape are
+    # taken to run to the full Depth.
+
+    iw,ih = INSET
+
+    its = sum(m+1 if m < INSET_DEPTH-1 else Depth for col in m_map for m in col)
+
+    return its * (SW*SH) / (iw*ih) / Throughput(Kernel)
+
+############################################################
+
+def PreviewKernel():
+
+    # Returns the kernel for previews and the Julia panel:
+    # the current kernel unless that is the precise kernel,
+    # which is far too slow
+
+    return GetKernel(Kernel if Kernel != "precise" else "python")
+
+############################################################
+
+def RequestInset():
+
+    # Asks for a zoom preview of the current zoom rectangle,
+    # replacing any request not yet started
+
+    global InsetCount, InsetJob
+
+    InsetCount += 1
+
+    with InsetLock:
+        InsetJob = [InsetCount, ZoomView(ViewRect, ZoomRect)]
+        InsetLock.notify()
+
+############################################################
+
+def CancelInset():
+
+    # Removes the zoom preview and abandons any request. The
+    # caller redraws the window.
+
+    global InsetCount, InsetJob, Inset, InsetMap, InsetPos
+
+    InsetCount += 1
+
+    if InsetLock != None:
+        with InsetLock:
+            InsetJob = None
+
+    Inset = None
+    InsetMap = None
+    InsetPos = None
+
+############################################################
+
+def ShowInset():
+
+    # Shows a zoom preview just calculated, unless it is for
+    # a zoom rectangle that has since changed
+
+    global InsetMap
+
+    with InsetLock:
+        n, m_map, secs = InsetDone
+
+    if n != InsetCount or ZoomRect == None:
+        return
+
+    InsetMap = m_map
+
+    if Dragging:
+        SetZoomCaption(secs)
+
+    MakeInset()
+
+    rects = PlaceInset()
+    DrawInset()
+
+    pygame.display.update(rects)
+
+############################################################
+
+def MakeInset():
+
+    # Colors the zoom preview using the current settings
+
+    global Inset
+
+    palette = MakePalette(InsetMap, Mapping, Gradient, Clip, INSET_DEPTH)
+    rgb = RenderBytes(InsetMap, palette)
+
+    Inset = pygame.image.frombuffer(rgb, INSET, "RGB").copy()
+
+############################################################
+
+def PlaceInset():
+
+    # Positions the zoom preview in the corner away from the
+    # zoom rectangle, restoring the image where it was if it
+    # moves. Returns the areas of Surface changed.
+
+    global InsetPos
+
+    if Inset == None or ZoomRect == None:
+        return []
+
+    x,y,w,h = RelRect(NormRect(ZoomRect))
+    iw,ih = INSET
+
+    pos = (INSET_GAP if x + w/2 >= SW/2 else SW - iw - INSET_GAP,
+           INSET_GAP if y + h/2 >= SH/2 else SH - ih - INSET_GAP)
+
+    rects = [InsetFrame(pos)]
+
+    if InsetPos != None and InsetPos != pos:
+        r = InsetFrame(InsetPos)
+        Surface.blit(Image, r, r)
+        rects.append(r)
+
+    InsetPos = pos
+
+    return rects
+
+############################################################
+
+def InsetFrame(pos):
+
+    # Returns the rect (x,y,w,h) of the zoom preview at pos
+    # including its one pixel outline
+
+    iw,ih = INSET
+
+    return (pos[0]-1, pos[1]-1, iw+2, ih+2)
+
+############################################################
+
+def DrawInset():
+
+    if Inset == None:
+        return
+
+    pygame.draw.rect(Surface,(255,0,0),InsetFrame(InsetPos),1)
+    Surface.blit(Inset, InsetPos)
+
+############################################################
+
+def ToggleJulia():
+
+    # Shows or hides the Julia panel by resizing the window
+
+    global Julia, Surface, JuliaC, JuliaImage
+
+    Julia = not Julia
+
+    Surface = pygame.display.set_mode((SW + JULIA_SIZE[0] if Julia else SW, SH))
+
+    JuliaC = None
+    JuliaImage = None
+
+    if Julia:
+        mx,my = Cursor if Cursor != None and Cursor[0] < SW else (SW//2, SH//2)
+        SetJuliaC(mx,my)
+
+    Draw()
+
+############################################################
+
+def SetJuliaC(mx,my):
+
+    # Shows the Julia set for c at a pixel of the view, at
+    # the lowest resolution and depth to keep up with the
+    # mouse. It is refined later by RefineJulia().
+
+    global JuliaC, JuliaMoved
+
+    x,y,w,h = ViewRect
+
+    JuliaC = complex(x - w/2 + w*mx/SW, y + h/2 - h*my/SH)
+    JuliaMoved = time.perf_counter()
+
+    DrawJulia(0)
+
+############################################################
+
+def RefineJulia():
+
+    # Draws the Julia set at the next resolution step. Any
+    # event arriving abandons the step.
+
+    types = [getattr(pygame, e) for e in ALL_EVENTS]
+
+    DrawJulia(JuliaStep + 1, lambda percent: not pygame.event.peek(types))
+
+############################################################
+
+def JuliaWait():
+
+    # Returns milliseconds to wait for events before the
+    # Julia panel should be refined, or None if it is
+    # finished (or not shown)
+
+    if not Julia or JuliaC == None or JuliaStep == len(JULIA_STEPS)-1:
+        return None
+
+    return max(1, round((JULIA_PAUSE - (time.perf_counter() - JuliaMoved))*1000))
+
+############################################################
+
+def DrawJulia(step, progress = None):
+
+    # Calculates and draws the Julia panel at a resolution
+    # step. The first step uses INSET_DEPTH, later steps the
+    # full Depth.
+
+    global JuliaMap, JuliaStep
+
+    jw = JULIA_SIZE[0] // JULIA_STEPS[step]
+    jh = JULIA_SIZE[1] // JULIA_STEPS[step]
+
+    m_map = PreviewKernel()(JULIA_VIEW, jw, jh, JuliaDepth(step), progress, JuliaC)
+
+    if m_map == None:
+        return
+
+    JuliaMap = m_map
+    JuliaStep = step
+
+    MakeJuliaImage()
+
+    Surface.blit(JuliaImage,(SW,0))
+    pygame.display.update((SW, 0) + JULIA_SIZE)
+
+############################################################
+
+def JuliaDepth(step):
+
+    return INSET_DEPTH if step == 0 else Depth
+
+############################################################
+
+def MakeJuliaImage():
+
+    # Colors the Julia panel using the current settings,
+    # scaled up to the panel size
+
+    global JuliaImage
+
+    depth = JuliaDepth(JuliaStep)
+
+    palette = MakePalette(JuliaMap, Mapping, Gradient, Clip, depth)
+    rgb = RenderBytes(JuliaMap, palette)
+
+    image = pygame.image.frombuffer(rgb, (len(JuliaMap), len(JuliaMap[0])), "RGB")
+
+    JuliaImage = pygame.transform.scale(image, JULIA_SIZE)
+
+############################################################
+
+def SetReadyCaption():
+
+    # Shows the current color settings in the window caption
+
+    pygame.display.set_caption("Ready (" + Mapping + " " + Gradient +
+                               " " + format(Clip,"g") + "%)")
+
+############################################################
+
+def CycleColors(key):
+
+    # Selects the next Mapping (M), Gradient (G) or Clip (C)
+    # and recolors the current view from Map. Other keys are
+    # ignored.
+
+    global Mapping, Gradient, Clip
+
+    if key == pygame.K_m:
+        Mapping = MAPPINGS[(MAPPINGS.index(Mapping) + 1) % len(MAPPINGS)]
+    elif key == pygame.K_g:
+        Gradient = GRADIENTS[(GRADIENTS.index(Gradient) + 1) % len(GRADIENTS)]
+    elif key == pygame.K_c:
+        Clip = CLIPS[(CLIPS.index(Clip) + 1) % len(CLIPS)] if Clip in CLIPS else CLIP
+    else:
+        return
+
+    Recolor()
+
+    if Inset != None: MakeInset()
+    if JuliaImage != None: MakeJuliaImage()
+
+    SetReadyCaption()
+    Draw()
+
+############################################################
+
+def GetEvent():
+
+    # Awaits OS and mouse event for view window. Sleeps
+    # while waiting so as not to hog CPU. Allowed events
+    # are pre-filtered to minimise wasteful processing.
+    # Events are processed one at a time as they arrive
+    # off the event queue, except that mouse motion events
+    # which have piled up are coalesced so that only the
+    # latest position is handled. While the Julia panel is
+    # unfinished, waiting stops when the mouse has paused so
+    # that the panel can be refined. Likewise when prefetching,
+    # so that the view under the mouse can be prefetched.
+    
+    global IdleSince
+
+    wait = JuliaWait()
+
+    if wait != None:
+        event = pygame.event.wait(wait)
+        if event.type == pygame.NOEVENT:
+            RefineJulia()
+            return
+    else:
+        if Prefetching: Prefetch()
+        wait = PrefetchWait()
+        event = pygame.event.wait() if wait == None else pygame.event.wait(wait)
+        if event.type == pygame.NOEVENT:
+            return
+
+    if event.type == pygame.MOUSEMOTION:
+        event = CoalesceMotion(event)
+
+    if Recording != None and event.type != pygame.USEREVENT:
+        RecordEvent(event, time.perf_counter() - IdleSince)
+
+    HandleEvent(event)
+
+    IdleSince = time.perf_counter()
+
+############################################################
+
+def CoalesceMotion(event):
+
+    # Returns the last of the mouse motion events at the head
+    # of the queue, starting with event, and removes them.
+    # Motions after any other event (e.g. the button release
+    # ending a drag) are left queued behind it, in order.
+
+    queued = pygame.event.get()
+
+    n = 0
+
+    while n < len(queued) and queued[n].type == pygame.MOUSEMOTION:
+        event = queued[n]
+        n += 1
+
+    for later in queued[n:]:
+        pygame.event.post(later)
+
+    return event
+
+############################################################
+
+def HandleEvent(event):
+
+    # Acts on a single OS, mouse or key event
+    
+    global Closing, Cursor, CursorMoved
+
+    if event.type == pygame.QUIT:
+        Closing = True
+        return
+
+    if event.type == pygame.KEYDOWN:
+        if event.key == pygame.K_j:
+            ToggleJulia()
+        else:
+            CycleColors(event.key)
+        return
+
+    if event.type == pygame.USEREVENT:
+        ShowInset()
+        return
+
+    if not hasattr(event, "pos"):
+        return
+
+    mx, my = event.pos
+
+    if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+
+        if mx >= SW:
+            return
+
+        if ZoomRect == None:
+            StartDrag(mx,my) 
+        else:
+            if WithinZoomRect(mx,my):
+                Zoom()
+            else:
+                ClearZoomRect()
+        return
+
+    if event.type == pygame.MOUSEMOTION:
+
+        Cursor = (mx,my)
+        CursorMoved = time.perf_counter()
+                    
+        if Dragging:
+            UpdateDrag(mx,my)
+        elif Julia and mx < SW:
+            SetJuliaC(mx,my)
+        return
+
+    if event.type == pygame.MOUSEBUTTONUP and event.button == 1:
+
+        if Dragging: EndDrag()
+        return
+
+############################################################
+
+def StartRecording():
+
+    # Starts recording events of the view window to RecordFile
+    # if requested. The file has one JSON object per line: a
+    # header with the initial view and settings followed by
+    # one line per event handled. Each event records the
+    # "gap" in seconds between the previous event finishing
+    # and this one arriving, i.e. the user's idle time.
+
+    global Recording
+
+    if RecordFile == None:
+        return
+
+    Recording = open(RecordFile, "w")
+
+    header = {"view": list(ViewRect), "size": [SW, SH], "depth": Depth,
+              "kernel": Kernel, "mapping": Mapping, "gradient": Gradient,
+              "clip": Clip, "index": Indexed, "prefetch": Prefetching,
+              "resume": Resumable, "adaptive": Adaptive}
+
+    Recording.write(json.dumps(header) + "\n")
+
+############################################################
+
+def RecordEvent(event, gap):
+
+    # Writes one event to the recording. Only the event types
+    # in ALL_EVENTS are ever handled.
+
+    name = [e for e in ALL_EVENTS if getattr(pygame, e) == event.type][0]
+
+    rec = {"gap": round(gap, 4), "type": name}
+
+    for attr in ["pos", "button", "key"]:
+        if hasattr(event, attr):
+            rec[attr] = getattr(event, attr)
+
+    Recording.write(json.dumps(rec) + "\n")
+    Recording.flush()
+
+############################################################
+
+def StopRecording():
+
+    global Recording
+
+    if Recording != None:
+        Recording.close()
+        Recording = None
+
+############################################################
+
+def ViewLoop():
+
+    # Initialises view-related variables and opens view window.
+    # Generates initial Mandelbrot view and then waits for and
+    # processes window events repeatedly until window is closed.
+
+    print("-----------------------------------------------------------------")
+    print("Generating Initial View")
+    print("-----------------------------------------------------------------")
+
+    global IdleSince
+
+    InitViewVars()
+    InitViewWindow()
+
+    StartStep()
+    Calc()
+    Draw()
+    MarkTime("final")
+
+    StartRecording()
+
+    IdleSince = time.perf_counter()
+
+    while not Closing: GetEvent()
+
+    StopRecording()
+
+    pygame.quit()
         
 ############################################################
 
@@ -993,17 +1606,239 @@ def MainLoop():
         if Quitting: break
         if ViewRect != None: ViewLoop()
 
+############################################################
+
+def CalcView(view, max_d, progress = None, checkpoint = True):
+
+    # Returns a new map of Mandelbrot values for a view using
+    # the selected kernel: through the index of uniform areas
+    # if enabled (--index), resumably if enabled (--resume),
+    # or with the depth of each tile chosen up to max_d if
+    # enabled (--adaptive). Views calculated resumably are
+    # only checkpointed if checkpoint is True.
+
+    if Resumable:
+        from MandelbrotCheckpoint import CalcMapResumable, CheckpointPath
+        path = CheckpointPath(view, SW, SH, max_d) if checkpoint else None
+        return CalcMapResumable(view, SW, SH, max_d, progress, path)
+
+    if Adaptive:
+        import MandelbrotAdaptive
+        m_map = MandelbrotAdaptive.CalcMapAdaptive(view, SW, SH, max_d, progress, GetKernel(Kernel))
+        depths = MandelbrotAdaptive.Depths
+        if Timing and m_map != None:
+            print("Depths   = ", min(depths), "to", max(depths), "mean",
+                  format(sum(depths)/len(depths), ".0f"))
+        return m_map
+
+    if not Indexed:
+        start = time.perf_counter()
+        m_map = GetKernel(Kernel)(view, SW, SH, max_d, progress)
+        LearnRate(Kernel, m_map, time.perf_counter() - start)
+        return m_map
+
+    import MandelbrotIndex
+
+    m_map = MandelbrotIndex.CalcMapIndexed(view, SW, SH, max_d, progress, GetKernel(Kernel))
+
+    if Timing:
+        print("Indexed  = ", ", ".join(k + " " + str(n) for k, n in MandelbrotIndex.Stats.items()), "pixels")
+
+    return m_map
+
+############################################################
+
+def Headless(args):
+
+    # Generates an image without opening a view window (or
+    # loading Pygame). The Mandelbrot values are either
+    # calculated for the given view or loaded from a map file
+    # previously saved with --save-map, in which case the
+    # view is only recolored. Views narrower than MIN_WIDTH
+    # are beyond floating-point precision and are calculated
+    # exactly by the (much slower) precise engine.
+
+    global ViewRect, Map, Palette
+
+    if args.export != None:
+        Export(args)
+        if args.output == None and args.save_map == None:
+            return
+
+    if args.map != None:
+        Map, ViewRect, max_d = LoadMap(args.map)
+        PrintView()
+        
+    elif args.resume not in [False, True]:
+        from MandelbrotCheckpoint import CalcMapResumable, CheckpointView
+        ViewRect, max_d = CheckpointView(args.resume, SW, SH)
+        PrintView()
+        Map = CalcMapResumable(ViewRect, SW, SH, max_d, None, args.resume)
+
+    elif args.precise or (args.view != None and args.view[2] < MIN_WIDTH):
+        from MandelbrotPrecise import CalcMapPrecise
+        x,y,w = args.view if args.view != None else [Decimal(str(v)) for v in WORLDVIEW[:3]]
+        ViewRect = [x,y,w,w*SH/SW]
+        max_d = args.depth
+        PrintView()
+        Map = CalcMapPrecise(ViewRect, SW, SH, max_d)
+
+    else:
+        x,y,w = [float(v) for v in args.view] if args.view != None else WORLDVIEW[:3]
+        h,dp = Compact(w/AR)
+        ViewRect = [x,y,w,h]
+        max_d = args.depth
+        PrintView()
+        Map = CalcView(ViewRect, max_d)
+
+    Palette = MakePalette(Map, args.mapping, args.gradient, args.clip, max_d)
+
+    if args.save_map != None:
+        SaveMap(args.save_map, Map, ViewRect, max_d)
+
+    if args.output != None:
+        WritePng(args.output, RenderBytes(Map, Palette), len(Map), len(Map[0]))
+
+############################################################
+
+def Export(args):
+
+    # Writes the raw Mandelbrot values of the headless view
+    # to a grid file at a resolution of --size pixels (see
+    # MandelbrotExport), without keeping them in memory
+
+    from MandelbrotExport import ExportGrid
+
+    sw,sh = args.size if args.size != None else (SW,SH)
+
+    x,y,w = args.view if args.view != None else [Decimal(str(v)) for v in WORLDVIEW[:3]]
+
+    if args.precise or w < MIN_WIDTH:
+        view, kernel = [x, y, w, w*sh/sw], "precise"
+    else:
+        view, kernel = [float(x), float(y), float(w), float(w)*sh/sw], Kernel
+
+    if args.smooth and kernel == "precise":
+        print("Smooth values cannot be exported beyond floating-point precision")
+        return
+
+    def Progress(percent):
+        print("Exported = ", format(percent, "3.0f"), "%", end = "\r", flush = True)
+
+    ExportGrid(args.export, view, sw, sh, args.depth, kernel, args.smooth, Progress)
+
+    Progress(100)
+    print()
+    print("Exported to", args.export, "(" + str(sw), "x", sh, "pixels)")
+    print("-----------------------------------------------------------------")
+
+############################################################
+
+def ParseArgs():
+
+    # With no arguments the interactive menu is used. Any of
+    # --view, --map, --output or --export selects headless mode.
+
+    p = argparse.ArgumentParser(description="Mandelbrot Viewer")
+
+    p.add_argument("--view", nargs=3, type=Decimal, metavar=("X","Y","W"),
+                   help="center coordinates and width of headless view")
+    p.add_argument("--map", metavar="FILE",
+                   help="recolor values saved with --save-map")
+    p.add_argument("--save-map", metavar="FILE",
+                   help="save Mandelbrot values for later recoloring")
+    p.add_argument("--precise", action="store_true",
+                   help="calculate headless view with exact arithmetic")
+    p.add_argument("--output", metavar="FILE",
+                   help="write headless image to PNG file")
+    p.add_argument("--depth", type=int, default=MAX_DEPTH, metavar="N",
+                   help="max iterations of views")
+    p.add_argument("--export", metavar="FILE",
+                   help="write raw Mandelbrot values to a grid file")
+    p.add_argument("--size", nargs=2, type=int, metavar=("W","H"),
+                   help="pixels of exported grid (default: view window size)")
+    p.add_argument("--smooth", action="store_true",
+                   help="also export smooth escape values")
+    p.add_argument("--mapping", choices=MAPPINGS, default=Mapping)
+    p.add_argument("--gradient", choices=GRADIENTS, default=Gradient)
+    p.add_argument("--clip", type=float, default=Clip, metavar="PERCENT")
+    p.add_argument("--kernel", choices=list(KERNELS),
+                   help="force kernel (default: fastest calibrated)")
+    p.add_argument("--index", action="store_true",
+                   help="skip areas proven uniform, kept in ~/.mandelbrot_index")
+    p.add_argument("--prefetch", action="store_true",
+                   help="calculate likely next views while idle")
+    p.add_argument("--resume", nargs="?", const=True, default=False, metavar="FILE",
+                   help="checkpoint views so interrupted ones can be resumed,"
+                        " or resume the view of a checkpoint FILE (python kernel only)")
+    p.add_argument("--adaptive", action="store_true",
+                   help="choose the depth of each tile, up to --depth"
+                        " (not with vectorised kernels)")
+    p.add_argument("--record", metavar="FILE",
+                   help="record view window events for MandelbrotReplay.py")
+    p.add_argument("--timing", action="store_true",
+                   help="report drag frame times and index use on console")
+
+    args = p.parse_args()
+
+    # Resumable views are always calculated in pure Python,
+    # one pixel at a time, so these options would be ignored
+
+    if args.resume:
+        for option, used in [("--index", args.index), ("--adaptive", args.adaptive),
+                             ("--kernel", args.kernel not in [None, "python"])]:
+            if used:
+                p.error("--resume cannot be combined with " + option)
+
+    # A checkpoint file gives its own view and depth
+
+    if args.resume not in [False, True]:
+        for option, used in [("--view", args.view != None), ("--map", args.map != None),
+                             ("--precise", args.precise)]:
+            if used:
+                p.error("--resume FILE cannot be combined with " + option)
+        if args.output == None and args.save_map == None:
+            p.error("--resume FILE needs --output or --save-map")
+
+    return args
+
 ############################################################
 # START OF PROGRAM
 ############################################################
 
-print("Mandelbrot Viewer 1.0 Copyright (C) RVJ Callanan")
-print("This is FREE software released under the GPLv3")
-print()
+if __name__ == "__main__":
 
-MainLoop()
+    print("Mandelbrot Viewer 1.0 Copyright (C) RVJ Callanan")
+    print("This is FREE software released under the GPLv3")
+    print()
+
+    Args = ParseArgs()
+
+    Mapping     = Args.mapping
+    Gradient    = Args.gradient
+    Clip        = Args.clip
+    Timing      = Args.timing
+    RecordFile  = Args.record
+    Indexed     = Args.index
+    Prefetching = Args.prefetch
+    Resumable   = Args.resume != False
+    Adaptive    = Args.adaptive
+    Kernel      = SelectKernel(Args.kernel)
+    Depth       = Args.depth
+
+    if Adaptive and Kernel in VECTORISED:
+        print("Adaptive depth is not used with the " + Kernel + " kernel,")
+        print("which already stops working on pixels once they escape.")
+        print()
+        Adaptive = False
+
+    if (Args.view != None or Args.map != None or Args.output != None or Args.export != None or
+        Args.resume not in [False, True]):
+        Headless(Args)
+    else:
+        MainLoop()
 
-sys.exit()
+    sys.exit()
 
 ############################################################
 # END OF PROGRAM
@@ -0,0 +1,144 @@
+############################################################
+#
+# Mandelbrot 1.0 Copyright (C) RVJ Callanan 2012
+#
+# This is FREE software, licensed under the GNU GPLv3
+# See: <http://www.gnu.org/licenses/>.
+#
+############################################################
+#
+# MANDELBROT ADAPTIVE DEPTH
+#
+# Most of a view needs far fewer iterations than its deepest
+# parts. CalcMapAdaptive() calculates a map like a kernel, but
+# in tiles of ADAPT_TILE pixels, each at its own depth. To find
+# it, a sparse SAMPLE of the tile's pixels is calculated at
+# START_DEPTH and then at double the depth, up to max_d, for
+# as long as doing so still lets more of them escape. Once the
+# fraction not escaped has changed by no more than STABLE for
+# STABLE_STEPS doublings in a row, the tile has all the detail
+# it is going to get and is calculated at that depth. (A single
+# stable doubling is not enough: near the neck of the set whole
+# tiles escape slowly, after hundreds of iterations.)
+#
+# This saves most where large areas lie inside the set, which
+# per pixel kernels otherwise take to max_d. Vectorised kernels
+# (see VECTORISED) already drop pixels once they escape and are
+# only slowed down by working a tile at a time, so the viewer
+# and tile server do not use adaptive depth with them.
+#
+# NOTE ABOUT COLORS
+#
+# The count at which a point escapes does not depend on the
+# depth, so escaped pixels have the same values whatever the
+# depth of their tile. Only pixels that did not escape differ:
+# they have the value depth-1 of their own tile. These are
+# given the value max_d-1 instead, as if their tile had been
+# calculated at max_d, so that the palette and BalancePalette()
+# treat them alike in every tile and no seams show between
+# tiles of different depths.
+
+############################################################
+# IMPORTS
+############################################################
+
+from MandelbrotEngine import *
+
+############################################################
+# CONSTANTS
+############################################################
+
+ADAPT_TILE  = 50            # Tile size (pixels)
+SAMPLE      = (10, 10)      # Pixels sampled to choose depth of tile
+START_DEPTH = 64            # Depth every tile starts at
+STABLE      = 0.01          # Change in unescaped fraction to stop at
+STABLE_STEPS = 2            # Doublings in a row that must be stable
+
+############################################################
+# Global Variables
+############################################################
+
+Depths      = []            # Depth of each tile of last map
+
+############################################################
+# FUNCTIONS
+############################################################
+
+def CalcMapAdaptive(view, sw = SW, sh = SH, max_d = MAX_DEPTH,
+                    progress = None, kernel = CalcMap, start_d = START_DEPTH):
+
+    # Returns a new map of Mandelbrot values for a view in the
+    # same way as a kernel at depth max_d, but with each tile
+    # calculated by the kernel at the least depth, from
+    # start_d up, that shows all its detail
+
+    global Depths
+
+    m_map = NewMap(sw, sh)
+
+    Depths = []
+
+    tiles = [(x0, y0, min(x0 + ADAPT_TILE, sw), min(y0 + ADAPT_TILE, sh))
+             for x0 in range(0, sw, ADAPT_TILE) for y0 in range(0, sh, ADAPT_TILE)]
+
+    for n, (x0, y0, x1, y1) in enumerate(tiles):
+
+        if progress != None and progress(100*n/len(tiles)) == False:
+            return None
+
+        tile = SubView(view, sw, sh, x0, y0, x1, y1)
+
+        d = TileDepth(tile, max_d, kernel, start_d)
+        cols = kernel(tile, x1-x0, y1-y0, d)
+
+        Depths.append(d)
+
+        for sx, col in enumerate(cols, x0):
+            m_map[sx][y0:y1] = [max_d-1 if m == d-1 else m for m in col]
+
+    #endfor
+
+    return m_map
+
+############################################################
+
+def TileDepth(tile, max_d, kernel = CalcMap, start_d = START_DEPTH):
+
+    # Returns the depth a tile needs, found by calculating a
+    # sparse sample of its pixels at ever greater depths
+    # until the fraction not escaped is stable
+
+    gw,gh = SAMPLE
+
+    d = min(start_d, max_d)
+    inside = Unescaped(kernel(tile, gw, gh, d), d)
+
+    stable = 0
+
+    while d < max_d and inside > 0 and stable < STABLE_STEPS:
+
+        deeper = min(2*d, max_d)
+        now = Unescaped(kernel(tile, gw, gh, deeper), deeper)
+
+        stable = stable + 1 if inside - now <= STABLE else 0
+
+        d, inside = deeper, now
+
+    #endwhile
+
+    return d
+
+############################################################
+
+def Unescaped(m_map, max_d):
+
+    # Returns the fraction of the pixels of a map which did
+    # not escape within max_d iterations
+
+    total = sum(len(col) for col in m_map)
+
+    return sum(col.count(max_d-1) for col in m_map) / total
+
+############################################################
+# END OF MODULE
+############################################################
@@ -0,0 +1,263 @@
+############################################################
+#
+# Mandelbrot 1.0 Copyright (C) RVJ Callanan 2012
+#
+# This is FREE software, licensed under the GNU GPLv3
+# See: <http://www.gnu.org/licenses/>.
+#
+############################################################
+#
+# MANDELBROT CHECKPOINTS
+#
+# CalcMapResumable() calculates a map like CalcMap(), giving
+# exactly the same values, but can be interrupted at any time
+# and resumed later from a checkpoint file instead of starting
+# over. Checkpoints are saved every CHECKPOINT_SECS, so that
+# little is lost even if the program crashes or is killed,
+# and whenever the calculation is abandoned through progress.
+# The checkpoint is deleted once the map is finished.
+#
+# NOTE ABOUT THE CALCULATION
+#
+# Rather than finishing one pixel at a time, every unfinished
+# pixel is taken SLICE iterations further on each pass, so
+# that the work left is always spread evenly and can be saved
+# at any moment. A checkpoint holds:
+#
+#   - the Mandelbrot values of the pixels finished so far
+#   - the histogram of those values (pixels per value)
+#   - each unfinished pixel with its z and iteration count
+#
+# The file starts with a text header line giving the format
+# version (CHECKPOINT_VERSION) and the view, size and depth it
+# is for, followed by the arrays above in binary compressed
+# with zlib. Values are 32-bit so that any depth can be saved.
+# Checkpoints of other versions are ignored. The view in the
+# header is exact, so a checkpoint can be resumed by file (see
+# CheckpointView) whatever view it was saved from.
+
+############################################################
+# IMPORTS
+############################################################
+
+import os, time, hashlib, zlib
+from array import array
+from MandelbrotEngine import *
+
+############################################################
+# CONSTANTS
+############################################################
+
+CHECKPOINT_DIR  = "checkpoints"     # Default checkpoint directory
+CHECKPOINT_SECS = 10.0              # Time between checkpoints
+CHECKPOINT_VERSION = 2              # Version of checkpoint format
+SLICE           = 1000              # Iterations per pixel per pass
+CHUNK           = 1000              # Pixels between progress calls
+
+############################################################
+# FUNCTIONS
+############################################################
+
+def CalcMapResumable(view, sw = SW, sh = SH, max_d = MAX_DEPTH,
+                     progress = None, path = None):
+
+    # Returns a new map of Mandelbrot values for a view in the
+    # same way as CalcMap(), resuming from the checkpoint file
+    # path if there is one for the same view, size and depth.
+    # If progress returns False a checkpoint is saved (if path
+    # is given) and None is returned.
+
+    state = LoadCheckpoint(path, view, sw, sh, max_d) if path != None else None
+
+    if state == None:
+        state = NewState(sw, sh, max_d)
+
+    values = state["values"]
+    hist   = state["hist"]
+
+    cw = view[2]
+    ch = view[3]
+    cx = view[0] - cw/2
+    cy = view[1] + ch/2
+
+    total = sw*sh
+    saved = time.perf_counter()
+
+    while len(state["pixels"]) > 0:
+
+        pixels, zrs, zis, its = state["pixels"], state["zr"], state["zi"], state["its"]
+
+        # Survivors of this pass
+
+        left = {"pixels": array("I"), "zr": array("d"), "zi": array("d"), "its": array("I")}
+
+        for start in range(0, len(pixels), CHUNK):
+
+            # Work left is the survivors so far plus the
+            # pixels not yet taken further in this pass
+
+            done = total - len(left["pixels"]) - (len(pixels) - start)
+
+            stop = progress != None and progress(100*done/total) == False
+
+            if path != None and (stop or time.perf_counter() - saved >= CHECKPOINT_SECS):
+                rest = {k: left[k] + state[k][start:] for k in left}
+                SaveCheckpoint(path, dict(state, **rest), view, sw, sh, max_d)
+                saved = time.perf_counter()
+
+            if stop:
+                return None
+
+            for n in range(start, min(start + CHUNK, len(pixels))):
+
+                i = pixels[n]
+                c = complex(cx + cw*((i//sh)/sw), cy - ch*((i%sh)/sh))
+
+                m0 = its[n]
+                z = complex(zrs[n], zis[n]) if m0 > 0 else c
+
+                m1 = min(m0 + SLICE, max_d)
+
+                for m in range(m0, m1):
+                    z = z*z + c
+                    if abs(z) >= 2.0: break
+                else:
+                    if m1 < max_d:
+                        left["pixels"].append(i)
+                        left["zr"].append(z.real)
+                        left["zi"].append(z.imag)
+                        left["its"].append(m1)
+                        continue
+
+                values[i] = m
+                hist[m] += 1
+
+            #endfor
+
+        #endfor
+
+        state.update(left)
+
+    #endwhile
+
+    if path != None and os.path.exists(path):
+        os.remove(path)
+
+    return MapFromArray(values, sw, sh)
+
+############################################################
+
+def NewState(sw, sh, max_d):
+
+    # Returns the state of a calculation not yet started:
+    # every pixel unfinished with no iterations done, in
+    # which case z is taken to be c (as in CalcColumns)
+
+    total = sw*sh
+
+    state = {"values": array("I", bytes(4*total)),
+             "hist":   array("I", bytes(4*max_d)),
+             "pixels": array("I", range(total)),
+             "zr":     array("d", bytes(8*total)),
+             "zi":     array("d", bytes(8*total)),
+             "its":    array("I", bytes(4*total))}
+
+    return state
+
+############################################################
+
+def CheckpointPath(view, sw, sh, max_d, directory = CHECKPOINT_DIR):
+
+    # Returns the checkpoint file path for a calculation
+
+    key = repr(([str(v) for v in view], sw, sh, max_d)).encode("ascii")
+
+    return os.path.join(directory, hashlib.sha1(key).hexdigest() + ".ckpt")
+
+############################################################
+
+def SaveCheckpoint(path, state, view, sw, sh, max_d):
+
+    # Saves the state of a calculation. The file is written
+    # under a temporary name and then renamed, so that an
+    # interruption while saving never leaves a broken file.
+
+    directory = os.path.dirname(path)
+
+    if directory != "":
+        os.makedirs(directory, exist_ok = True)
+
+    header = "MANDELBROT-CHECKPOINT %d %d %d %d %d %s %s %s %s\n" % (
+             CHECKPOINT_VERSION, sw, sh, max_d, len(state["pixels"]),
+             view[0], view[1], view[2], view[3])
+
+    body = b"".join(state[k].tobytes() for k in ["values", "hist", "pixels", "zr", "zi", "its"])
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(header.encode("ascii"))
+        f.write(zlib.compress(body))
+
+    os.replace(path + ".tmp", path)
+
+############################################################
+
+def CheckpointView(path, sw, sh):
+
+    # Returns the view and depth a checkpoint file is for, so
+    # that it can be resumed without giving the view again.
+    # Raises ValueError if it is not a checkpoint of this
+    # version for views of sw x sh pixels.
+
+    try:
+        with open(path, "rb") as f:
+            header = f.readline().decode("ascii").split()
+    except (OSError, UnicodeDecodeError):
+        header = []
+
+    if (len(header) != 10 or header[0] != "MANDELBROT-CHECKPOINT" or
+        header[1] != str(CHECKPOINT_VERSION)):
+        raise ValueError("Not a checkpoint of this version: " + path)
+
+    if header[2:4] != [str(sw), str(sh)]:
+        raise ValueError("Checkpoint is for views of " + header[2] + " x " + header[3] + " pixels")
+
+    return [float(v) for v in header[6:]], int(header[4])
+
+############################################################
+
+def LoadCheckpoint(path, view, sw, sh, max_d):
+
+    # Returns the state saved in a checkpoint file, or None
+    # if there is none or it is for a different calculation
+
+    try:
+        with open(path, "rb") as f:
+            header = f.readline().decode("ascii").split()
+            body = zlib.decompress(f.read())
+    except (OSError, UnicodeDecodeError, zlib.error):
+        return None
+
+    if (len(header) != 10 or header[0] != "MANDELBROT-CHECKPOINT" or
+        header[1:5] != [str(CHECKPOINT_VERSION), str(sw), str(sh), str(max_d)] or
+        header[6:] != [str(v) for v in view]):
+        return None
+
+    pending = int(header[5])
+
+    sizes = [("values", "I", sw*sh), ("hist", "I", max_d), ("pixels", "I", pending),
+             ("zr", "d", pending), ("zi", "d", pending), ("its", "I", pending)]
+
+    state = {}
+    offset = 0
+
+    for key, code, count in sizes:
+        state[key] = array(code)
+        end = offset + state[key].itemsize * count
+        state[key].frombytes(body[offset:end])
+        offset = end
+
+    return state
+
+############################################################
+# END OF MODULE
+############################################################
@@ -0,0 +1,774 @@
+############################################################
+#
+# Mandelbrot 1.0 Copyright (C) RVJ Callanan 2012
+#
+# This is FREE software, licensed under the GNU GPLv3
+# See: <http://www.gnu.org/licenses/>.
+#
+############################################################
+#
+# MANDELBROT ENGINE
+#
+# Everything needed to calculate and color a view of the
+# Mandelbrot Set without a display: view math, Pass One of
+# the calculation, palette balancing and number compaction.
+# Importing this module has no side effects and does not
+# load Pygame, so it can be used from the viewer, headless
+# scripts, worker processes and tests alike.
+#
+# COMPLEX OR REAL CALCULATIONS?
+#
+# Python's ability to process Complex Numbers is so fast that
+# there is little benefit to using the Mandelbrot algorithm for
+# the Real Plane (see Wikipedia article on the Mandelbrot Set).
+# Using the Complex version also has the benefit of underlying
+# the algorithm's simplicity
+#
+# NOTE ABOUT COORDINATES
+#
+# View coordinates in the Complex plane are floating-point
+# numbers. The Real part (X) increases towards the right and
+# the Imaginary part (Y) increases towards the top. The view
+# rectangle is specified by CENTER coordinates, width and
+# height (X,Y,W,H).
+#
+# Screen coordinates are in integer pixels relative to (0,0)
+# at the top left of the window. The X value increases towards
+# the right of the screen BUT the Y value increases towards
+# the bottom. The zoom rectangle consists of the screen
+# coordinates of the starting and end points of the zoom drag.
+# When both coordinates are identical, this implies a zoom
+# rectangle width and height of ONE (zero widths and heights
+# are not possible in this instance).
+#
+# NOTE ABOUT MAPS AND PALETTES
+#
+# A map is a list of columns, each a list of Mandelbrot values
+# (iteration counts), so that map[sx][sy] is the value at
+# screen pixel (sx,sy). A palette has one [std, bal, pix]
+# entry for each Mandelbrot value: its standard color, its
+# balanced color and the number of pixels with that value.
+
+############################################################
+# IMPORTS
+############################################################
+
+import struct, zlib
+from array import array
+from decimal import Decimal, localcontext
+from math import *
+from colorsys import *
+
+############################################################
+# CONSTANTS
+############################################################
+
+MAX_DEPTH   = 256           # Max Mandelbrot iterations
+SW          = 600           # Screen Width
+SH          = 400           # Screen Height
+AR          = SW/SH         # Aspect Ratio
+
+ESTIMATE_GRID = (SW//20, SH//20)    # Pixels sampled to estimate cost
+
+CLIP        = 1.0           # Default palette tail clip (%)
+CLIPS       = [0.0, 0.1, 1.0, 2.5, 5.0]    # Selectable clips (%)
+
+MAPPINGS    = ["CLIP", "EQUALISE"]                      # Balancing
+GRADIENTS   = ["GREY", "FIRE", "OCEAN", "SPECTRUM"]     # Colors
+
+PRECISION   = 0.01          # Compaction precision (1%)
+MAX_DP       = 16           # Max decimal places used
+SUB_DIGITS  = 20            # Decimal sub-view digits beyond a pixel
+
+REF_X       = -0.75         # Start X coordinate
+REF_Y       = 0.0           # Start Y coordinate
+MIN_WIDTH   = 1E-15         # Minimum view width
+MAX_WIDTH   = 4.5           # Maximum view width
+MIN_HEIGHT  = MIN_WIDTH/AR  # Minimum view height
+MAX_HEIGHT  = MAX_WIDTH/AR  # Maximum view height
+
+MIN_X = REF_X - MAX_WIDTH/2
+MAX_X = REF_X + MAX_WIDTH/2
+MIN_Y = REF_Y - MAX_HEIGHT/2
+MAX_Y = REF_Y + MAX_HEIGHT/2
+
+WORLDVIEW = [REF_X, REF_Y, MAX_WIDTH, MAX_HEIGHT]
+
+VIEW0 = [-0.090,          0.964,          0.165,          0.110       ]
+VIEW1 = [-1.25079,        0.02242,        0.00065,        0.00043     ]
+VIEW2 = [-0.7698,         0.1095,         0.0042,         0.0028 ]
+VIEW3 = [-0.74627,        0.12041,        0.00039,        0.00026     ]
+VIEW4 = [0.3231,          -0.0354,        0.0092,         0.0061      ]
+VIEW5 = [-1.94081,        0.00088,        0.00082,        0.00055     ]
+VIEW6 = [-0.5261,         0.5067,         0.0216,         0.0144      ]
+VIEW7 = [0.35496,         0.34629,        0.00028,        0.00019     ]
+VIEW8 = [-1.7491005,      0.0003483,      0.0000255,      0.0000170   ]
+VIEW9 = [-1.785693031,    0.000000869,    0.000000315,    0.000000210 ]
+
+DESC0   = "Thorny Branches"
+DESC1   = "Exotic Island"
+DESC2   = "Jelly Fish"
+DESC3   = "Sea Horses"
+DESC4   = "Fan of Elephants"
+DESC5   = "Spindly Bug"
+DESC6   = "Potted Plants"
+DESC7   = "Claw Spiral"
+DESC8   = "Spiky Tail"
+DESC9   = "Brocolli Junction"
+
+VIEWS = [VIEW0, VIEW1, VIEW2, VIEW3, VIEW4,
+         VIEW5, VIEW6, VIEW7, VIEW8, VIEW9]
+
+DESCS = [DESC0, DESC1, DESC2, DESC3, DESC4,
+         DESC5, DESC6, DESC7, DESC8, DESC9]
+
+############################################################
+# FUNCTIONS
+############################################################
+
+def NewMap(sw = SW, sh = SH):
+
+    # Returns a new map of Mandelbrot values set to zero
+
+    return [[0] * sh for x in range(sw)]
+
+############################################################
+
+def CalcMap(view, sw = SW, sh = SH, max_d = MAX_DEPTH, progress = None, julia = None):
+
+    # PASS ONE - CALCULATE MANDELBROT VALUES
+    #
+    # Returns a new map of Mandelbrot values for the view
+    # rectangle at a resolution of sw x sh pixels. If supplied,
+    # progress is called with the percentage completed before
+    # each column. It may return False to abandon the
+    # calculation, in which case None is returned. If julia is
+    # given, the map is of the Julia set for c = julia instead
+    # (see CalcColumns).
+
+    m_map = [None] * sw
+
+    sx_percent = 100/sw
+    percent = 0.0
+
+    for sx in range(sw):
+
+        if progress != None and progress(percent) == False:
+            return None
+
+        percent += sx_percent
+
+        m_map[sx] = CalcColumns(view, sw, sh, max_d, sx, sx+1, julia)[0]
+
+    return m_map
+
+############################################################
+
+def CalcColumns(view, sw, sh, max_d, x0, x1, julia = None):
+
+    # Returns Mandelbrot values of columns x0..x1-1 of a view
+    # at a resolution of sw x sh pixels as a list of columns.
+    # Calculating a range of columns on its own gives exactly
+    # the same values as calculating the whole view, so views
+    # can be split up between processes.
+    #
+    # The same iteration z = z*z + c gives the Julia sets: for
+    # the Mandelbrot Set c is the pixel and z starts at c, for
+    # a Julia set c is fixed (julia) and z starts at the pixel.
+
+    # Get complex coordinates at top left of screen
+    # noting that y axis have opposite directions
+
+    cw = view[2]
+    ch = view[3]
+    cx = view[0] - cw/2
+    cy = view[1] + ch/2
+
+    cols = []
+
+    for sx in range(x0, x1):
+
+        col = [0] * sh
+        re = cx + cw*(sx/sw)
+
+        for sy in range(sh):
+
+            im = cy - ch*(sy/sh)
+
+            z = complex(re,im)
+            c = z if julia == None else julia
+
+            for m in range(max_d):
+                z = z*z + c
+                if abs(z) >= 2.0: break
+
+            col[sy] = m
+
+        #endfor
+
+        cols.append(col)
+
+    #endfor
+
+    return cols
+
+############################################################
+
+def MapIterations(m_map):
+
+    # Returns the total number of iterations calculating a
+    # map took. A Mandelbrot value of m took m+1 iterations.
+
+    return sum(sum(col) + len(col) for col in m_map)
+
+############################################################
+
+def EstimateIterations(view, sw = SW, sh = SH, max_d = MAX_DEPTH, grid = ESTIMATE_GRID):
+
+    # Returns an estimate of the total number of iterations
+    # of a view at a resolution of sw x sh pixels, found by
+    # calculating a sparse grid of its pixels. The default
+    # grid costs about 1/400 of calculating the view itself,
+    # and is made coarser for smaller views (e.g. tiles) so
+    # that it never costs more.
+
+    gw,gh = min(grid[0], ceil(sw/20)), min(grid[1], ceil(sh/20))
+
+    sample = CalcMap([float(v) for v in view], gw, gh, max_d)
+
+    return MapIterations(sample) * (sw*sh) / (gw*gh)
+
+############################################################
+
+def InitPalette(gradient = "GREY", max_d = MAX_DEPTH):
+
+    # Returns a new palette with standard colors set up,
+    # balanced colors initialised to match standard colors
+    # and pixel counts set to zero. Standard colors run from
+    # the lightest color of the gradient down to black for
+    # the deepest value.
+
+    palette = [None] * max_d
+
+    pix = 0
+
+    for m in range(max_d):
+
+        std = GradientColor(m/(max_d-1), gradient)
+        bal = std
+
+        palette[m] = [std, bal, pix]
+
+    return palette
+
+############################################################
+
+def GradientColor(t, gradient = "GREY"):
+
+    # Returns [r,g,b] color of the gradient at position t
+    # which runs from 0.0 (fast escape) to 1.0 (no escape).
+    # All gradients finish on black so that the interior of
+    # the set looks the same whatever the color scheme. The
+    # original linear greyscale is GREY.
+
+    if gradient == "FIRE":
+        rgb = hsv_to_rgb((1-t)/6, min(1.0, 2*t), 1 - t*t)
+
+    elif gradient == "OCEAN":
+        rgb = hsv_to_rgb(0.5 + 0.2*t, 0.3 + 0.7*t, 1 - t)
+
+    elif gradient == "SPECTRUM":
+        rgb = hsv_to_rgb(0.85*t, 1.0, 1 - t**8)
+
+    else:
+        v = 1 - t
+        rgb = (v,v,v)
+
+    return [round(255*v) for v in rgb]
+
+############################################################
+
+def ClearPalette(palette):
+
+    # Clears all pixel counts in palette
+
+    for entry in palette:
+        entry[2] = 0
+
+############################################################
+
+def CountPalette(palette, m_map):
+
+    # Regenerates palette pixel counts from the Mandelbrot
+    # values held in a map. The map is the source of truth for
+    # a view, so this allows the palette to be rebuilt (e.g.
+    # with a different gradient) without recalculating.
+
+    ClearPalette(palette)
+
+    for col in m_map:
+        for m in col:
+            palette[m][2] += 1
+
+############################################################
+
+def BalancePalette(palette, mapping = "CLIP", clip = CLIP):
+
+    # Balance/re-balance color palette based on pixel counts
+    # already generated for each Mandelbrot value. The
+    # balancing method is set by mapping:
+    #
+    # CLIP identifies the minimum and maximum Mandelbrot values
+    # which account for all but clip% of pixels at either end
+    # of the range i.e at least clip% are below min threshold
+    # and at least clip% are above max threshold. Ignoring a
+    # small percentage of pixels at either extreme reveals
+    # enough detail at either extreme while preventing tiny hot
+    # spots from skewing the color balance. The min and max
+    # values thus obtained are then used to calculate offset
+    # and gain parameters for generating balanced colors.
+    #
+    # EQUALISE spreads colors according to the cumulative pixel
+    # count so that each color is used by roughly the same
+    # number of pixels (histogram equalisation). This brings
+    # out detail in views dominated by a narrow band of values.
+    #
+    # The objective is to give the most efficient and
+    # informative visual representation for any given view
+    # within normal computing constraints.
+
+    max_d = len(palette)
+    pixels = sum([entry[2] for entry in palette])
+
+    if mapping == "EQUALISE" and pixels > 0:
+
+        # The first (lowest) value in use maps to the first
+        # color and the last value in use to the last color
+
+        cum = 0
+        cum_min = None
+
+        for m in range(0, max_d, 1):
+
+            cum += palette[m][2]
+
+            if cum_min == None and cum > 0:
+                cum_min = cum
+
+            if cum_min == None or cum_min == pixels:
+                b = 0
+            else:
+                b = int((max_d-1) * (cum - cum_min) / (pixels - cum_min))
+
+            palette[m][1] = palette[b][0]
+
+        return
+
+    min_thresh = pixels*clip/100
+    max_thresh = pixels*clip/100
+
+    min_pixels = 0
+    max_pixels = 0
+
+    for m in range(0, max_d, 1):
+
+        min_m = m
+        min_pixels += palette[m][2]
+
+        if min_pixels >= min_thresh:
+            break
+
+    for m in range(max_d-1, -1, -1):
+
+        max_m = m
+        max_pixels += palette[m][2]
+
+        if max_pixels >= max_thresh:
+            break
+
+    # Calculate offset and gain that will render
+    # Mandelbrot values using full palette range
+
+    if max_m <= min_m:
+        offset = 0
+        gain   = 1.0
+    else:
+        offset = min_m
+        gain   = (max_d-1)/(max_m - min_m)
+
+    # Now update palette balanced colors
+
+    for m in range(0, max_d, 1):
+
+        b = int(gain * (m - offset))
+        if b < 0: b = 0
+        if b >= max_d: b = max_d - 1
+
+        palette[m][1] = palette[b][0]
+
+############################################################
+
+def MakePalette(m_map, mapping = "CLIP", gradient = "GREY", clip = CLIP,
+                max_d = MAX_DEPTH):
+
+    # Returns a palette balanced for the Mandelbrot values in
+    # a map. This is all that is needed to recolor a view.
+
+    palette = InitPalette(gradient, max_d)
+    CountPalette(palette, m_map)
+    BalancePalette(palette, mapping, clip)
+
+    return palette
+
+############################################################
+
+def RenderBytes(m_map, palette):
+
+    # Returns a map as rows of RGB bytes using the balanced
+    # palette colors. Maps are stored by column so they are
+    # transposed into screen rows here. Each Mandelbrot value
+    # is looked up in a pre-built table of byte strings which
+    # is much faster than setting pixels one at a time.
+
+    lut = [bytes(entry[1]) for entry in palette]
+
+    return b"".join([lut[m] for row in zip(*m_map) for m in row])
+
+############################################################
+
+def AbsRect(r):
+
+    # Converts a screen rectangle in the form (x,y,w,h)
+    # to one with absolute coordinates (x1,y1,x2,y2).
+    # Note that widths and heights must be non-zero and
+    # positive. A width and height of 1 pixel will
+    # produce identical start and end coordinates
+
+    x1 = r[0]
+    x2 = r[0] + r[2] - 1
+
+    y1 = r[1]
+    y2 = r[1] + r[3] - 1
+
+    return (x1,y1,x2,y2)
+
+############################################################
+
+def RelRect(r):
+
+    # Converts a screen rectangle in the form (x1,y1,x2,y2)
+    # to one with relative coordinates (x,y,w,h). Note that
+    # identical start and end coordinates will produce a
+    # width and height of 1 pixel. Input rectangle must be
+    # normalised.
+
+    x1 = r[0]
+    w = r[2] - r[0] + 1
+
+    y1 = r[1]
+    h = r[3] - r[1] + 1
+
+    return (x1,y1,w,h)
+
+############################################################
+
+def NormRect(r):
+
+    # Normalises a rectangle with absolute coordinates so that
+    # the returned x1,y1 coordinates are less than x2,y2.
+
+    x1 = r[0]
+    y1 = r[1]
+    x2 = r[2]
+    y2 = r[3]
+
+    if x1 > x2:
+        x1,x2 = x2,x1
+
+    if y1 > y2:
+        y1,y2 = y2,y1
+
+    return (x1,y1,x2,y2)
+
+############################################################
+
+def ZoomView(view, zoom_rect):
+
+    # Returns the view rectangle covered by a zoom rectangle
+    # drawn on the screen for the given view. Because the
+    # zoom rectangle is integer based, it may have slight
+    # aspect-ratio errors. For critical floating point
+    # calculations, derive height from width using the
+    # global aspect-ratio.
+
+    # Map zoom rectangle to view coordinate system
+    # which is centered with y increasing upwards
+
+    rz = RelRect(NormRect(zoom_rect))
+
+    rx,ry,rw,rh = [float(r) for r in rz]
+
+    zw = rw
+    zh = rw/AR
+    zx = rx - SW/2 + zw/2
+    zy = -(ry - SH/2 + zh/2)
+
+    # Can now generate new view using simple scaling
+
+    vx,vy,vw,vh = view
+
+    nx = vx + vw*zx/SW
+    ny = vy + vh*zy/SH
+    nw = vw*zw/SW
+    nh = nw/AR
+
+    return [nx,ny,nw,nh]
+
+############################################################
+
+def TileView(z, x, y):
+
+    # Returns the view rectangle (X,Y,W,H) covered by tile
+    # (z,x,y) of the quadtree of the complex plane. Zoom level
+    # 0 is a single tile covering a square of side MAX_WIDTH
+    # centered on the WORLDVIEW. Each zoom level splits every
+    # tile into four, with x increasing towards the right and
+    # y increasing towards the BOTTOM, just like screen
+    # coordinates.
+
+    side = MAX_WIDTH / 2**z
+
+    left = REF_X - MAX_WIDTH/2 + x*side
+    top  = REF_Y + MAX_WIDTH/2 - y*side
+
+    return [left + side/2, top - side/2, side, side]
+
+############################################################
+
+def SubView(view, sw, sh, x0, y0, x1, y1):
+
+    # Returns the view rectangle whose pixels at a resolution
+    # of (x1-x0) x (y1-y0) are pixels x0..x1-1, y0..y1-1 of a
+    # view at a resolution of sw x sh. Decimal views (see
+    # MandelbrotPrecise) are worked out with every digit of
+    # the view and SUB_DIGITS more than the width of a pixel,
+    # rather than rounded to the default 28 digits.
+
+    if isinstance(view[2], Decimal):
+
+        pixel = min(view[2]/sw, Decimal(view[3])/sh)
+        places = max([-Decimal(v).as_tuple().exponent for v in view] +
+                     [SUB_DIGITS - pixel.adjusted()])
+
+        with localcontext() as ctx:
+            ctx.prec = places + 8
+            view = [Decimal(v) for v in view]
+            return SubRect(view, sw, sh, x0, y0, x1, y1)
+
+    return SubRect(view, sw, sh, x0, y0, x1, y1)
+
+############################################################
+
+def SubRect(view, sw, sh, x0, y0, x1, y1):
+
+    # Works out SubView() in the current arithmetic
+
+    cw = view[2]
+    ch = view[3]
+
+    left = view[0] - cw/2 + cw*x0/sw
+    top  = view[1] + ch/2 - ch*y0/sh
+
+    w = cw*(x1 - x0)/sw
+    h = ch*(y1 - y0)/sh
+
+    return [left + w/2, top - h/2, w, h]
+
+############################################################
+
+def Compact(r, max_dp = MAX_DP):
+
+    # Converts raw floating point number into most compact
+    # decimal form that meets the required precision. Also
+    # returns number of decimal places used, which is at most
+    # max_dp. Deep views need more than MAX_DP decimal places
+    # (see ViewDp) and use Decimal coordinates, which are
+    # compacted with enough digits to honour max_dp.
+
+    with localcontext() as ctx:
+
+        ctx.prec = max_dp + 20
+
+        if r == 0.0:
+            return r,0
+        elif r < 0:
+            neg = True
+        else:
+            neg = False
+
+        r = abs(r)
+
+        dp = -floor(log10(r))
+
+        while True:
+
+            c = round(r,dp)
+
+            if abs((c-r)/r) <= PRECISION:
+                break
+
+            dp = dp + 1
+
+            if dp > max_dp:
+                c = r
+                dp = max_dp
+                break
+
+        if neg: c = -c
+
+    return c, dp
+
+############################################################
+
+def CompactView(view, max_dp = MAX_DP):
+
+    # Returns compacted version of view coordinates using
+    # maximum precision required across all 4 values
+
+    vx,vy,vw,vh = view
+
+    cx,dpx = Compact(vx, max_dp)
+    cy,dpy = Compact(vy, max_dp)
+    cw,dpw = Compact(vw, max_dp)
+    ch,dph = Compact(vh, max_dp)
+
+    maxdp = max([dpx,dpy,dpw,dph])
+
+    return [FmtDp(v,maxdp) for v in view]
+
+############################################################
+
+def ViewDp(view, sw = SW):
+
+    # Returns the number of decimal places needed to tell
+    # neighbouring pixels of a view apart, or MAX_DP if that
+    # is enough
+
+    return max(MAX_DP, ceil(-log10(view[2]/sw)) + 2)
+
+############################################################
+
+def FmtDp(f,dp = None):
+
+    # Formats floating point value with indicated decimal
+    # or MAX_DP if dp argument is not supplied
+
+    if dp == None:
+        dp = MAX_DP
+
+    return format(f," ." + str(dp) + "f")
+
+############################################################
+
+def WritePng(filename, rgb, w, h):
+
+    # Writes rows of RGB bytes to a PNG file using only the
+    # standard library so that images can be saved headless
+
+    with open(filename, "wb") as f:
+        f.write(PngBytes(rgb, w, h))
+
+############################################################
+
+def PngBytes(rgb, w, h):
+
+    # Encodes rows of RGB bytes as a PNG image
+
+    def chunk(tag, data):
+        crc = zlib.crc32(tag + data) & 0xFFFFFFFF
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", crc)
+
+    stride = w * 3
+    raw = b"".join([b"\x00" + rgb[y*stride:(y+1)*stride] for y in range(h)])
+
+    return (b"\x89PNG\r\n\x1a\n" +
+            chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)) +
+            chunk(b"IDAT", zlib.compress(raw)) +
+            chunk(b"IEND", b""))
+
+############################################################
+
+def SaveMap(filename, m_map, view, max_d = MAX_DEPTH):
+
+    # Saves Mandelbrot values in a map together with the view
+    # so that the view can be recolored later without being
+    # recalculated. The file is a one line text header
+    # followed by 16-bit values stored column by column, or
+    # 32-bit values (MANDELBROT-MAP32) for depths that need
+    # them.
+
+    sw = len(m_map)
+    sh = len(m_map[0])
+
+    data = MapToArray(m_map)
+
+    header = "%s %d %d %d %s %s %s %s\n" % (
+        "MANDELBROT-MAP" if data.typecode == "H" else "MANDELBROT-MAP32",
+        sw, sh, max_d, *view)
+
+    with open(filename, "wb") as f:
+        f.write(header.encode("ascii"))
+        data.tofile(f)
+
+############################################################
+
+def LoadMap(filename):
+
+    # Loads a map previously saved by SaveMap(). Returns the
+    # map, view rectangle and depth. A view saved as floats
+    # comes back as floats, and any other (a Decimal view) as
+    # Decimal, so that no digits are lost.
+
+    with open(filename, "rb") as f:
+
+        fields = f.readline().decode("ascii").split()
+
+        if len(fields) != 8 or fields[0] not in ["MANDELBROT-MAP", "MANDELBROT-MAP32"]:
+            raise ValueError("Not a Mandelbrot map file: " + filename)
+
+        sw, sh, max_d = [int(v) for v in fields[1:4]]
+        view = fields[4:8]
+
+        if all(repr(float(v)) == v for v in view):
+            view = [float(v) for v in view]
+        else:
+            view = [Decimal(v) for v in view]
+
+        data = array("H" if fields[0] == "MANDELBROT-MAP" else "I")
+        data.fromfile(f, sw * sh)
+
+    return MapFromArray(data, sw, sh), view, max_d
+
+############################################################
+
+def MapToArray(m_map):
+
+    # Returns Mandelbrot values of a map as a compact array
+    # of 16-bit values stored column by column, or of 32-bit
+    # values if any are too big for 16 bits
+
+    values = [m for col in m_map for m in col]
+
+    return array("H" if max(values) <= 0xFFFF else "I", values)
+
+############################################################
+
+def MapFromArray(data, sw, sh):
+
+    # Returns a map from an array made by MapToArray()
+
+    return [data[sx*sh:(sx+1)*sh].tolist() for sx in range(sw)]
+
+############################################################
+# END OF MODULE
+############################################################
@@ -0,0 +1,284 @@
+############################################################
+#
+# Mandelbrot 1.0 Copyright (C) RVJ Callanan 2012
+#
+# This is FREE software, licensed under the GNU GPLv3
+# See: <http://www.gnu.org/licenses/>.
+#
+############################################################
+#
+# MANDELBROT GRID EXPORT
+#
+# ExportGrid() writes the raw Mandelbrot values (iteration
+# counts) of a view, and optionally smooth escape values, to a
+# grid file for other programs to analyse or color. The view
+# is calculated and written a strip of columns at a time, so
+# the size of the grid is limited by disk space, not memory.
+# OpenGrid() maps a grid file into memory without reading or
+# copying it. To show the header of a grid file:
+#
+#   python MandelbrotExport.py FILE
+#
+# NOTE ABOUT THE FORMAT
+#
+# A grid file starts with a text header of HEADER_SIZE bytes:
+# ASCII lines of "key value..." ending with a line "end", then
+# padded with zero bytes. The keys are:
+#
+#   MANDELBROT-GRID 1           format name and version
+#   width 600                   pixels across
+#   height 400                  pixels down
+#   depth 256                   max iterations
+#   view X Y W H                center, width and height
+#   engine numpy                kernel that did the counts
+#   order column                column by column (see below)
+#   counts uint32le OFFSET      where the counts start
+#   smooth float32le OFFSET     where smooth values start,
+#                               or "smooth none"
+#
+# Readers should ignore keys they do not know. Counts are
+# little-endian unsigned 32-bit integers stored column by
+# column, as in a map: pixel (sx,sy), counted from the top
+# left, is item sx*height + sy. Counts are the Mandelbrot
+# values of CalcMap(), so pixels which did not escape have the
+# count depth-1. With NumPy for example:
+#
+#   counts = numpy.memmap(FILE, "<u4", "r", OFFSET, (width, height))
+#
+# Smooth values follow the counts in the same order as
+# little-endian 32-bit floats. For a pixel which escaped after
+# count iterations with |z| >= 2 they are
+#
+#   count + 1 - log2(log2(|z|))
+#
+# which varies continuously across pixels rather than in
+# steps, and they are NaN for pixels which did not escape.
+# Smooth values are calculated by the "python" engine.
+
+############################################################
+# IMPORTS
+############################################################
+
+import os, sys, mmap, argparse
+from array import array
+from math import *
+from MandelbrotEngine import *
+from MandelbrotKernels import GetKernel
+
+############################################################
+# CONSTANTS
+############################################################
+
+GRID_FORMAT  = "MANDELBROT-GRID"
+GRID_VERSION = 1
+HEADER_SIZE  = 4096             # Header bytes (one memory page)
+STRIP_PIXELS = 1 << 20          # Pixels calculated at a time
+
+############################################################
+# FUNCTIONS
+############################################################
+
+def ExportGrid(filename, view, sw = SW, sh = SH, max_d = MAX_DEPTH,
+               kernel = "python", smooth = False, progress = None):
+
+    # Calculates a view at a resolution of sw x sh pixels
+    # with a kernel (by name) and writes its counts, and
+    # smooth values if smooth, to a grid file. If progress
+    # returns False the export is abandoned and False is
+    # returned. The file is written under a temporary name
+    # and renamed when complete.
+
+    if smooth:
+        kernel = "python"
+
+    calc = GetKernel(kernel)
+
+    counts_at = HEADER_SIZE
+    smooth_at = counts_at + 4*sw*sh if smooth else None
+
+    header = GridHeader(view, sw, sh, max_d, kernel, counts_at, smooth_at)
+
+    strip = max(1, STRIP_PIXELS // sh)
+
+    finished = True
+
+    with open(filename + ".tmp", "wb") as f:
+
+        f.write(header)
+        f.truncate((smooth_at or counts_at) + 4*sw*sh)
+
+        for x0 in range(0, sw, strip):
+
+            if progress != None and progress(100*x0/sw) == False:
+                finished = False
+                break
+
+            x1 = min(x0 + strip, sw)
+
+            if smooth:
+                cols, nus = SmoothColumns(view, sw, sh, max_d, x0, x1)
+                WriteStrip(f, smooth_at + 4*x0*sh, array("f", [v for col in nus for v in col]))
+            else:
+                cols = calc(SubView(view, sw, sh, x0, 0, x1, sh), x1-x0, sh, max_d)
+
+            WriteStrip(f, counts_at + 4*x0*sh, array("I", [m for col in cols for m in col]))
+
+        #endfor
+
+    if finished:
+        os.replace(filename + ".tmp", filename)
+    else:
+        os.remove(filename + ".tmp")
+
+    return finished
+
+############################################################
+
+def GridHeader(view, sw, sh, max_d, engine, counts_at, smooth_at = None):
+
+    # Returns the header of a grid file padded to HEADER_SIZE
+
+    lines = ["%s %d" % (GRID_FORMAT, GRID_VERSION),
+             "width %d" % sw,
+             "height %d" % sh,
+             "depth %d" % max_d,
+             "view %s %s %s %s" % tuple(view),
+             "engine %s" % engine,
+             "order column",
+             "counts uint32le %d" % counts_at,
+             "smooth float32le %d" % smooth_at if smooth_at != None else "smooth none",
+             "end"]
+
+    header = ("\n".join(lines) + "\n").encode("ascii")
+
+    if len(header) > HEADER_SIZE:
+        raise ValueError("Grid header too long")
+
+    return header + bytes(HEADER_SIZE - len(header))
+
+############################################################
+
+def WriteStrip(f, offset, data):
+
+    # Writes an array of values at an offset in a file as
+    # little-endian, whatever the byte order of this machine
+
+    if sys.byteorder == "big":
+        data.byteswap()
+
+    f.seek(offset)
+    data.tofile(f)
+
+############################################################
+
+def SmoothColumns(view, sw, sh, max_d, x0, x1):
+
+    # Returns the Mandelbrot values of columns x0..x1-1 of a
+    # view, exactly as CalcColumns(), and their smooth escape
+    # values, each as a list of columns
+
+    cw = view[2]
+    ch = view[3]
+    cx = view[0] - cw/2
+    cy = view[1] + ch/2
+
+    cols = []
+    nus  = []
+
+    for sx in range(x0, x1):
+
+        col = [0] * sh
+        nu  = [nan] * sh
+        re = cx + cw*(sx/sw)
+
+        for sy in range(sh):
+
+            im = cy - ch*(sy/sh)
+
+            z = c = complex(re,im)
+
+            for m in range(max_d):
+                z = z*z + c
+                if abs(z) >= 2.0:
+                    nu[sy] = m + 1 - log2(log2(abs(z)))
+                    break
+
+            col[sy] = m
+
+        #endfor
+
+        cols.append(col)
+        nus.append(nu)
+
+    #endfor
+
+    return cols, nus
+
+############################################################
+
+def ReadGridHeader(filename):
+
+    # Returns the header of a grid file as a dictionary of
+    # lists of value strings by key, checking the format
+
+    with open(filename, "rb") as f:
+        text = f.read(HEADER_SIZE).split(b"\0")[0].decode("ascii")
+
+    lines = [line.split() for line in text.splitlines() if line.strip() != ""]
+
+    if len(lines) == 0 or lines[0] != [GRID_FORMAT, str(GRID_VERSION)]:
+        raise ValueError("Not a Mandelbrot grid file: " + filename)
+
+    info = {}
+
+    for line in lines[1:]:
+        if line[0] == "end": break
+        info[line[0]] = line[1:]
+
+    return info
+
+############################################################
+
+def OpenGrid(filename):
+
+    # Maps a grid file into memory. Returns its header (see
+    # ReadGridHeader), its counts and its smooth values (or
+    # None) as flat read-only views of the file, indexed by
+    # sx*height + sy, which read the file only as they are
+    # used. The views are in the byte order of the file, so
+    # on big-endian machines values must be swapped.
+
+    info = ReadGridHeader(filename)
+
+    sw = int(info["width"][0])
+    sh = int(info["height"][0])
+
+    with open(filename, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+    def View(key, code):
+        if info.get(key, ["none"])[0] == "none":
+            return None
+        offset = int(info[key][1])
+        return memoryview(data)[offset:offset + 4*sw*sh].cast(code)
+
+    return info, View("counts", "I"), View("smooth", "f")
+
+############################################################
+# START OF PROGRAM
+############################################################
+
+if __name__ == "__main__":
+
+    # Shows the header of a grid file
+
+    p = argparse.ArgumentParser(description="Mandelbrot Grid Export")
+    p.add_argument("grid", metavar="FILE", help="grid file to describe")
+    Args = p.parse_args()
+
+    for key, values in ReadGridHeader(Args.grid).items():
+        print(format(key, "8s"), "= ", " ".join(values))
+
+############################################################
+# END OF PROGRAM
+############################################################
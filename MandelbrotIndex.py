@@ -0,0 +1,496 @@
+############################################################
+#
+# Mandelbrot 1.0 Copyright (C) RVJ Callanan 2012
+#
+# This is FREE software, licensed under the GNU GPLv3
+# See: <http://www.gnu.org/licenses/>.
+#
+############################################################
+#
+# MANDELBROT INDEX
+#
+# Large areas of most views are either inside the set or
+# escape at one and the same low count. CalcMapIndexed() finds
+# such areas by checking the border of a screen rectangle: if
+# every border pixel has the same Mandelbrot value, the whole
+# rectangle is filled with it without calculating the inside
+# (the Mariani-Silver method). Otherwise the rectangle is split
+# into four and each quarter is checked in turn, down to
+# MIN_RECT pixels where the pixels are simply calculated by the
+# kernel. Border pixels are calculated one at a time, as calling
+# a kernel for strips one pixel wide costs far more than it
+# saves, and pixels inside the main cardioid and the period 2
+# bulb, which cannot escape, are not iterated at all.
+#
+# NOTE ABOUT THE INDEX
+#
+# Every rectangle proven uniform is also recorded as tiles of
+# the quadtree of the complex plane (see TileView) in an index
+# that is kept on disk in INDEX_FILE, so that later views, at
+# any zoom and in any session, can skip areas that were proven
+# before without even checking their borders. Pixels of a view
+# within tiles in the index are filled first, down to tiles of
+# MIN_TILE pixels, and only the rest of the view is checked.
+#
+# Each entry records the value and the depth (max iterations)
+# it was proven at. Values below depth-1 escaped, and the
+# count at which a point escapes does not depend on the depth,
+# so these stay valid at any depth. Values of depth-1 are
+# inside the set as far as that depth could tell, so they are
+# invalidated (and removed) as soon as a greater depth is used.
+
+############################################################
+# IMPORTS
+############################################################
+
+import os
+from math import *
+from MandelbrotEngine import *
+
+############################################################
+# CONSTANTS
+############################################################
+
+INDEX_FILE  = os.path.join(os.path.expanduser("~"), ".mandelbrot_index")
+
+MIN_RECT    = 16            # Rectangles this small are calculated
+MIN_TILE    = 4             # Smallest tiles looked up (pixels)
+RECORD_LEVELS = 2           # Levels of smaller tiles recorded per region
+MAX_LEVEL   = 60            # Deepest quadtree level indexed
+
+############################################################
+# Global Variables
+############################################################
+
+Index       = None          # Index entries [value, depth] by tile
+Parents     = set()         # Tiles containing smaller tiles in index
+Added       = []            # Entries added since index last saved
+Stats       = {}            # Pixels filled by method in last map
+
+############################################################
+# FUNCTIONS
+############################################################
+
+def LoadIndex(max_d = MAX_DEPTH):
+
+    # Loads the index from disk, dropping entries that are no
+    # longer valid at depth max_d. The file is rewritten
+    # without them if any were dropped. Each line of the file
+    # is one entry: "z x y value depth". Later lines override
+    # earlier ones for the same tile.
+
+    global Index, Parents
+
+    Index = {}
+    Parents = set()
+
+    try:
+        with open(INDEX_FILE) as f:
+            for line in f:
+                z,x,y,v,d = [int(n) for n in line.split()]
+                AddEntry(z, x, y, v, d)
+    except (OSError, ValueError):
+        pass
+
+    stale = [key for key in Index if not ValidEntry(Index[key], max_d)]
+
+    for key in stale:
+        del Index[key]
+
+    if len(stale) > 0:
+        SaveIndex(rewrite = True)
+
+############################################################
+
+def SaveIndex(rewrite = False):
+
+    # Appends entries added since the index was last saved to
+    # the index file, or rewrites the whole file
+
+    global Added
+
+    try:
+        if rewrite:
+            with open(INDEX_FILE, "w") as f:
+                for (z,x,y),(v,d) in Index.items():
+                    f.write("%d %d %d %d %d\n" % (z,x,y,v,d))
+        else:
+            with open(INDEX_FILE, "a") as f:
+                for z,x,y,v,d in Added:
+                    f.write("%d %d %d %d %d\n" % (z,x,y,v,d))
+    except OSError:
+        pass
+
+    Added = []
+
+############################################################
+
+def AddEntry(z, x, y, v, d):
+
+    # Adds an entry to the index and its tile's ancestors to
+    # Parents, so that lookups only descend where there are
+    # entries. Parents are not removed with their entries.
+
+    Index[(z,x,y)] = [v,d]
+
+    while z > 0:
+
+        z,x,y = z-1, x//2, y//2
+
+        if (z,x,y) in Parents:
+            break
+
+        Parents.add((z,x,y))
+
+############################################################
+
+def ValidEntry(entry, max_d):
+
+    # Returns True if an index entry can be used at depth
+    # max_d. Only entries inside the set are depth limited.
+
+    v,d = entry
+
+    return v < d-1 or max_d <= d
+
+############################################################
+
+def TileX(re, z):
+
+    # Returns the x index of the level z tile containing re
+
+    return floor((re - (REF_X - MAX_WIDTH/2)) * 2**z / MAX_WIDTH)
+
+############################################################
+
+def TileY(im, z):
+
+    # Returns the y index of the level z tile containing im
+
+    return floor(((REF_Y + MAX_WIDTH/2) - im) * 2**z / MAX_WIDTH)
+
+############################################################
+
+def LookupTile(z, x, y, max_d):
+
+    # Returns the Mandelbrot value of a tile at depth max_d if
+    # the tile or any tile containing it is in the index,
+    # otherwise None. Entries found to be invalid are removed.
+
+    while z >= 0:
+
+        entry = Index.get((z,x,y))
+
+        if entry != None:
+
+            if ValidEntry(entry, max_d):
+                return min(entry[0], max_d-1)
+
+            del Index[(z,x,y)]
+
+        z,x,y = z-1, x//2, y//2
+
+    return None
+
+############################################################
+
+def CoveredTiles(view, sw, sh, max_d):
+
+    # Returns the pixel rectangles (x0, y0, x1, y1, value) of a
+    # view at a resolution of sw x sh that lie within tiles in
+    # the index. Tiles are looked up from the level whose tiles
+    # are just larger than the view down to tiles of MIN_TILE
+    # pixels, where the index has any, so the index can cover
+    # any part of the view.
+
+    cw = view[2]
+    ch = view[3]
+    cx = view[0] - cw/2
+    cy = view[1] + ch/2
+
+    left = REF_X - MAX_WIDTH/2
+    top  = REF_Y + MAX_WIDTH/2
+
+    rects = []
+
+    def Walk(z, x, y, v):
+
+        side = MAX_WIDTH / 2**z
+
+        x0 = max(0, ceil((left + x*side - cx) * sw/cw))
+        x1 = min(sw, floor((left + (x+1)*side - cx) * sw/cw) + 1)
+        y0 = max(0, ceil((cy - (top - y*side)) * sh/ch))
+        y1 = min(sh, floor((cy - (top - (y+1)*side)) * sh/ch) + 1)
+
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        if v == None:
+            entry = Index.get((z,x,y))
+            if entry != None and ValidEntry(entry, max_d):
+                v = min(entry[0], max_d-1)
+
+        if v != None:
+            rects.append((x0, y0, x1, y1, v))
+            return
+
+        if (z,x,y) not in Parents or side/2 * sw/cw < MIN_TILE:
+            return
+
+        for x2 in (2*x, 2*x+1):
+            for y2 in (2*y, 2*y+1):
+                Walk(z+1, x2, y2, None)
+
+    z = max(0, min(MAX_LEVEL, floor(log2(MAX_WIDTH / max(cw, ch)))))
+
+    for x in range(TileX(cx, z), TileX(cx + cw, z) + 1):
+        for y in range(TileY(cy, z), TileY(cy - ch, z) + 1):
+            Walk(z, x, y, LookupTile(z, x, y, max_d))
+
+    return rects
+
+############################################################
+
+def UniformInside(re0, re1, im0, im1, v, max_d):
+
+    # Returns True if a region whose border has Mandelbrot
+    # value v must have value v inside too. Every z of the
+    # iteration is a polynomial in c, so by the maximum
+    # modulus principle nothing inside escapes sooner than
+    # the border. Nothing inside escapes later either, unless
+    # the region holds points of the set. As the set is
+    # connected and the border escaped, that would mean the
+    # region holds the whole set, and so c = 0.
+
+    if v == max_d-1:
+        return True
+
+    return not (re0 <= 0.0 <= re1 and im0 <= 0.0 <= im1)
+
+############################################################
+
+def InsideBulbs(c):
+
+    # Returns True if c lies inside the main cardioid or the
+    # period 2 bulb of the set, which never escape however
+    # deep the iteration, so the border pixels of the many
+    # views which show them need not be iterated
+
+    q = (c.real - 0.25)**2 + c.imag**2
+
+    return (q*(q + c.real - 0.25) < 0.25*c.imag**2 or
+            (c.real + 1)**2 + c.imag**2 < 0.0625)
+
+############################################################
+
+def Record(re0, re1, im0, im1, v, max_d):
+
+    # Records the tiles lying completely within a region of
+    # the complex plane proven to have Mandelbrot value v.
+    # Tiles are chosen at the level of the region, the largest
+    # that can fit in it, and up to RECORD_LEVELS levels of
+    # smaller tiles fill in the rest of the region around them.
+
+    extent = min(re1 - re0, im1 - im0)
+
+    if extent <= 0:
+        return
+
+    z = ceil(log2(MAX_WIDTH / extent))
+
+    if z > MAX_LEVEL:
+        return
+
+    left = REF_X - MAX_WIDTH/2
+    top  = REF_Y + MAX_WIDTH/2
+
+    def Add(z, x, y, levels):
+
+        side = MAX_WIDTH / 2**z
+
+        t_re0, t_re1 = left + x*side, left + (x+1)*side
+        t_im0, t_im1 = top - (y+1)*side, top - y*side
+
+        if t_re0 >= re1 or t_re1 <= re0 or t_im0 >= im1 or t_im1 <= im0:
+            return
+
+        if re0 <= t_re0 and t_re1 <= re1 and im0 <= t_im0 and t_im1 <= im1:
+            if LookupTile(z, x, y, max_d) == None:
+                AddEntry(z, x, y, v, max_d)
+                Added.append((z,x,y,v,max_d))
+        elif levels > 0 and z < MAX_LEVEL:
+            for cx in (2*x, 2*x+1):
+                for cy in (2*y, 2*y+1):
+                    Add(z+1, cx, cy, levels-1)
+
+    for x in range(TileX(re0, z), TileX(re1, z) + 1):
+        for y in range(TileY(im1, z), TileY(im0, z) + 1):
+            Add(z, x, y, RECORD_LEVELS)
+
+############################################################
+
+def CalcMapIndexed(view, sw = SW, sh = SH, max_d = MAX_DEPTH,
+                   progress = None, kernel = CalcMap):
+
+    # Returns a new map of Mandelbrot values for a view in the
+    # same way as a kernel, but fills the parts covered by the
+    # index first and then skips areas of the rest proven
+    # uniform by their borders. Border pixels are calculated
+    # one at a time here, and rectangles which cannot be
+    # skipped by the kernel given. Areas newly proven uniform
+    # are added to the index.
+
+    global Stats
+
+    if Index == None:
+        LoadIndex(max_d)
+
+    m_map = NewMap(sw, sh)
+    known = [bytearray(sh) for sx in range(sw)]
+
+    Stats = {"index": 0, "border": 0, "calc": 0}
+
+    cw = view[2]
+    ch = view[3]
+    cx = view[0] - cw/2
+    cy = view[1] + ch/2
+
+    def Bounds(x0, y0, x1, y1):
+
+        # Complex plane region spanned by pixels of rectangle
+
+        return (cx + cw*(x0/sw), cx + cw*((x1-1)/sw),
+                cy - ch*((y1-1)/sh), cy - ch*(y0/sh))
+
+    def Unknown(x0, y0, x1, y1):
+
+        # Number of pixels of rectangle not yet filled
+
+        return sum(known[sx].count(0, y0, y1) for sx in range(x0, x1))
+
+    def Fill(x0, y0, x1, y1, v):
+
+        for sx in range(x0, x1):
+            m_map[sx][y0:y1] = [v] * (y1-y0)
+            known[sx][y0:y1] = b"\1" * (y1-y0)
+
+    def Calc(x0, y0, x1, y1):
+
+        cols = kernel(SubView(view, sw, sh, x0, y0, x1, y1), x1-x0, y1-y0, max_d)
+
+        for sx, col in enumerate(cols, x0):
+            m_map[sx][y0:y1] = col
+            known[sx][y0:y1] = b"\1" * (y1-y0)
+
+    def Border(x0, y0, x1, y1):
+
+        # Returns the set of values of the border pixels of a
+        # rectangle, calculating those not yet filled, but
+        # stops as soon as it finds two values
+
+        values = set()
+
+        pixels = ([(sx, y0) for sx in range(x0, x1)] +
+                  [(sx, y1-1) for sx in range(x0, x1)] +
+                  [(x0, sy) for sy in range(y0+1, y1-1)] +
+                  [(x1-1, sy) for sy in range(y0+1, y1-1)])
+
+        for sx, sy in pixels:
+
+            if not known[sx][sy]:
+
+                z = c = complex(cx + cw*(sx/sw), cy - ch*(sy/sh))
+
+                if InsideBulbs(c):
+                    m = max_d-1
+                else:
+                    for m in range(max_d):
+                        z = z*z + c
+                        if abs(z) >= 2.0: break
+
+                m_map[sx][sy] = m
+                known[sx][sy] = 1
+                Stats["calc"] += 1
+
+            values.add(m_map[sx][sy])
+
+            if len(values) > 1:
+                break
+
+        #endfor
+
+        return values
+
+    def Rect(x0, y0, x1, y1):
+
+        # Resolves a rectangle, returning False if abandoned
+
+        if progress != None:
+            done = Stats["index"] + Stats["border"] + Stats["calc"]
+            if progress(100*done/(sw*sh)) == False:
+                return False
+
+        area = Unknown(x0, y0, x1, y1)
+
+        if area == 0:
+            return True
+
+        if x1-x0 <= MIN_RECT or y1-y0 <= MIN_RECT:
+            pending.append((x0, y0, x1, y1, area))
+            return True
+
+        values = Border(x0, y0, x1, y1)
+        bounds = Bounds(x0, y0, x1, y1)
+
+        if len(values) == 1 and UniformInside(*bounds, min(values), max_d):
+            v = values.pop()
+            Stats["border"] += Unknown(x0+1, y0+1, x1-1, y1-1)
+            Fill(x0+1, y0+1, x1-1, y1-1, v)
+            Record(*bounds, v, max_d)
+            return True
+
+        mx = (x0 + x1)//2
+        my = (y0 + y1)//2
+
+        return (Rect(x0, y0, mx, my) and Rect(mx, y0, x1, my) and
+                Rect(x0, my, mx, y1) and Rect(mx, my, x1, y1))
+
+    for x0, y0, x1, y1, v in CoveredTiles(view, sw, sh, max_d):
+        Stats["index"] += Unknown(x0, y0, x1, y1)
+        Fill(x0, y0, x1, y1, v)
+
+    pending = []
+
+    finished = Rect(0, 0, sw, sh)
+
+    # Small rectangles are calculated last, those one above
+    # the other in the same columns by a single kernel call
+
+    pending.sort()
+
+    while finished and len(pending) > 0:
+
+        if progress != None:
+            done = Stats["index"] + Stats["border"] + Stats["calc"]
+            if progress(100*done/(sw*sh)) == False:
+                finished = False
+                break
+
+        x0, y0, x1, y1, area = pending.pop(0)
+
+        while len(pending) > 0 and pending[0][:3] == (x0, y1, x1):
+            y1 = pending[0][3]
+            area += pending.pop(0)[4]
+
+        Calc(x0, y0, x1, y1)
+        Stats["calc"] += area
+
+    #endwhile
+
+    SaveIndex()
+
+    return m_map if finished else None
+
+############################################################
+# END OF MODULE
+############################################################
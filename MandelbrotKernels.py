@@ -0,0 +1,463 @@
+############################################################
+#
+# Mandelbrot 1.0 Copyright (C) RVJ Callanan 2012
+#
+# This is FREE software, licensed under the GNU GPLv3
+# See: <http://www.gnu.org/licenses/>.
+#
+############################################################
+#
+# MANDELBROT KERNELS
+#
+# A kernel is any function that calculates a map of Mandelbrot
+# values for a view. Every kernel is called in the same way:
+#
+#   m_map = kernel(view, sw, sh, max_d, progress, julia)
+#
+# with the same meaning as for CalcMap(), which is itself the
+# "python" kernel. julia is optional and selects a Julia set.
+# Kernels are registered by name in KERNELS so that the
+# viewer, headless path and tile server can choose between
+# them without knowing how they work.
+#
+# NOTE ABOUT CALIBRATION
+#
+# Which kernel is fastest depends on the machine (number of
+# CPUs, whether NumPy is installed etc). The first time a
+# kernel is needed, each automatic kernel is timed on a small
+# sample of the WORLDVIEW and the timings are cached in
+# CALIBRATION_FILE. The fastest kernel is then used unless
+# another is forced with --kernel or the MANDELBROT_KERNEL
+# environment variable, which is handy for A/B comparisons.
+# Kernels that give slightly different results (float32) or
+# are very slow (precise) are never chosen automatically.
+#
+# NOTE ABOUT ESTIMATES
+#
+# The calibration timings also give each kernel's throughput
+# in iterations per second. EstimateTime() divides this into
+# the iterations of a view, estimated from a sparse sample of
+# its pixels, to predict how long the view will take before
+# it is calculated. The calibration sample is small, so the
+# throughput is corrected by LearnRate() from every view the
+# viewer calculates and kept with the calibration timings.
+# The same estimate sizes the strips that views are split
+# into, so that progress is reported about every JOB_SECS
+# however expensive the view (or every StripSecs, which is
+# lowered for background work that must stop promptly).
+#
+#   python MandelbrotKernels.py [--recalibrate]
+
+############################################################
+# IMPORTS
+############################################################
+
+import os, sys, json, time, argparse
+from importlib.util import find_spec
+from concurrent.futures import ProcessPoolExecutor
+from math import *
+from MandelbrotEngine import *
+
+############################################################
+# CONSTANTS
+############################################################
+
+CALIBRATION_FILE = os.path.join(os.path.expanduser("~"), ".mandelbrot_kernels.json")
+CALIBRATION_SIZE = (SW//10, SH//10)     # Sample size (pixels)
+
+JOB_SECS    = 0.1           # Target time per strip (secs)
+JULIA_STRIP = 8             # Columns per strip of Julia sets
+
+VECTORISED  = ["numpy", "float32"]  # Kernels which drop escaped pixels
+
+############################################################
+# Global Variables
+############################################################
+
+KERNELS     = {}            # Kernel functions by name
+AUTO        = []            # Names of kernels eligible for calibration
+Pool        = None          # Process pool for "process" kernel
+Rates       = {}            # Iterations per second by kernel name
+StripSecs   = JOB_SECS      # Target time per strip, less for background work
+
+############################################################
+# FUNCTIONS
+############################################################
+
+def RegisterKernel(name, kernel, auto = True, available = True):
+
+    # Adds a kernel to the registry. Unavailable kernels (e.g.
+    # missing optional packages) are ignored. Only auto
+    # kernels take part in calibration.
+
+    if not available:
+        return
+
+    KERNELS[name] = kernel
+
+    if auto: AUTO.append(name)
+
+############################################################
+
+def GetKernel(name):
+
+    # Returns a registered kernel function by name
+
+    if name not in KERNELS:
+        raise ValueError("Unknown or unavailable kernel: " + name +
+                         " (choose from " + ", ".join(KERNELS) + ")")
+
+    return KERNELS[name]
+
+############################################################
+
+def SelectKernel(name = None, exclude = ()):
+
+    # Returns the name of the kernel to use. A name given on
+    # the command line wins, then MANDELBROT_KERNEL, then the
+    # fastest calibrated kernel not in exclude. Calibrates
+    # first if there are no valid cached timings.
+
+    if name == None:
+        name = os.environ.get("MANDELBROT_KERNEL")
+
+    if name != None:
+        GetKernel(name)
+        return name
+
+    timings = LoadCalibration()
+
+    if timings == None:
+        timings = Calibrate()
+
+    names = [n for n in timings if n not in exclude]
+
+    return min(names, key = lambda n: timings[n]) if len(names) > 0 else "python"
+
+############################################################
+
+def Calibrate(verbose = False):
+
+    # Times each automatic kernel on a small sample of the
+    # WORLDVIEW and caches the timings. Each kernel is run
+    # once to warm up (e.g. start processes) before timing.
+    # Returns timings in seconds by kernel name.
+
+    sw,sh = CALIBRATION_SIZE
+
+    timings = {}
+
+    for name in AUTO:
+
+        kernel = KERNELS[name]
+        kernel(WORLDVIEW, sw, sh, MAX_DEPTH)
+
+        start = time.perf_counter()
+        kernel(WORLDVIEW, sw, sh, MAX_DEPTH)
+        timings[name] = time.perf_counter() - start
+
+        if verbose:
+            print(format(name, "10s"), format(timings[name]*1000, "9.3f"), "ms")
+
+    SaveCalibration(timings)
+
+    return timings
+
+############################################################
+
+def LoadCalibration(key = "timings"):
+
+    # Returns cached timings (or learned rates), or None if
+    # there are none or they are stale because the available
+    # kernels or the Python version have changed
+
+    try:
+        with open(CALIBRATION_FILE) as f:
+            cal = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if cal.get("kernels") != AUTO or cal.get("python") != sys.version:
+        return None
+
+    return cal.get(key)
+
+############################################################
+
+def SaveCalibration(timings, rates = None):
+
+    cal = {"kernels": AUTO, "python": sys.version, "timings": timings}
+
+    if rates != None: cal["rates"] = rates
+
+    try:
+        with open(CALIBRATION_FILE, "w") as f:
+            json.dump(cal, f, indent = 1)
+    except OSError:
+        pass
+
+############################################################
+
+def Throughput(name):
+
+    # Returns a kernel's iterations per second, as learned
+    # from views calculated or else from its calibration
+    # timing. Kernels that were never calibrated (such as
+    # the precise kernel) are timed now on the same sample,
+    # in a single strip as their rate is not yet known.
+
+    if name in Rates:
+        return Rates[name]
+
+    rates = LoadCalibration("rates") or {}
+
+    if name in rates:
+        Rates[name] = rates[name]
+        return Rates[name]
+
+    sw,sh = CALIBRATION_SIZE
+
+    timings = LoadCalibration() or {}
+
+    if name in timings:
+        sample = CalcMap(WORLDVIEW, sw, sh, MAX_DEPTH)
+        secs = timings[name]
+    else:
+        kernel = GetKernel(name)
+        Rates[name] = inf
+        start = time.perf_counter()
+        sample = kernel(WORLDVIEW, sw, sh, MAX_DEPTH)
+        secs = time.perf_counter() - start
+
+    Rates[name] = MapIterations(sample) / max(secs, 1E-6)
+
+    return Rates[name]
+
+############################################################
+
+def LearnRate(name, m_map, secs):
+
+    # Corrects a kernel's throughput using a map it has just
+    # calculated in secs. Each new measurement counts for
+    # half, so the rate follows the views being explored.
+
+    if m_map == None or secs <= 0.0:
+        return
+
+    rate = MapIterations(m_map) / secs
+
+    Rates[name] = (Throughput(name) + rate) / 2
+
+    timings = LoadCalibration()
+
+    if timings != None:
+        SaveCalibration(timings, Rates)
+
+############################################################
+
+def EstimateTime(view, name, sw = SW, sh = SH, max_d = MAX_DEPTH, grid = ESTIMATE_GRID):
+
+    # Returns the estimated time in seconds for a kernel to
+    # calculate a view at a resolution of sw x sh pixels
+
+    return EstimateIterations(view, sw, sh, max_d, grid) / Throughput(name)
+
+############################################################
+
+def FmtSecs(secs):
+
+    # Formats an estimated time for display
+
+    if secs < 0.1:
+        return "<0.1 secs"
+
+    if secs < 60:
+        return "~" + format(secs, ".2g" if secs < 10 else ".0f") + " secs"
+
+    return "~" + format(secs/60, ".0f") + " mins"
+
+############################################################
+
+def PlanStrips(view, sw, sh, max_d, name, workers = 1, julia = None):
+
+    # Returns the number of columns per strip when a kernel
+    # splits a view into strips, so that each strip takes
+    # about StripSecs, but with at least one strip per worker.
+    # Estimates are for the Mandelbrot Set and say nothing
+    # about Julia sets, which are split into narrow strips.
+
+    if julia != None:
+        return min(JULIA_STRIP, max(1, ceil(sw / workers)))
+
+    secs = EstimateTime(view, name, sw, sh, max_d)
+
+    strips = max(workers, ceil(secs / StripSecs))
+
+    return max(1, ceil(sw / strips))
+
+############################################################
+
+def StripProgress(progress, sw):
+
+    # Returns a function that reports progress for a strip
+    # starting at column x0 and returns False to abandon
+
+    def report(x0):
+        return progress == None or progress(100*x0/sw) != False
+
+    return report
+
+############################################################
+
+def ProcessKernel(view, sw, sh, max_d = MAX_DEPTH, progress = None, julia = None):
+
+    # Pure Python kernel which shares strips of columns
+    # between one process per CPU
+
+    global Pool
+
+    if Pool == None:
+        Pool = ProcessPoolExecutor()
+
+    report = StripProgress(progress, sw)
+
+    strip = PlanStrips(view, sw, sh, max_d, "process", os.cpu_count() or 1, julia)
+
+    strips = range(0, sw, strip)
+
+    jobs = [Pool.submit(CalcColumns, view, sw, sh, max_d, x0, min(x0 + strip, sw), julia)
+            for x0 in strips]
+
+    m_map = []
+
+    for x0, job in zip(strips, jobs):
+
+        if not report(x0):
+            for j in jobs: j.cancel()
+            return None
+
+        m_map.extend(job.result())
+
+    return m_map
+
+############################################################
+
+def NumpyKernel(view, sw, sh, max_d = MAX_DEPTH, progress = None, julia = None,
+                dtype = "complex128"):
+
+    # Vectorised kernel using NumPy. Works on a strip of
+    # columns at a time so that progress can be reported.
+    # Cheap views are done in a few wide strips which
+    # vectorise better.
+    # Pixels which have escaped are dropped from the arrays
+    # so that later iterations only work on the survivors.
+
+    import numpy as np
+
+    report = StripProgress(progress, sw)
+
+    cw = view[2]
+    ch = view[3]
+    cx = view[0] - cw/2
+    cy = view[1] + ch/2
+
+    im = cy - ch*(np.arange(sh)/sh)
+
+    strip = PlanStrips(view, sw, sh, max_d, "float32" if dtype == "complex64" else "numpy",
+                       julia = julia)
+
+    m_map = []
+
+    for x0 in range(0, sw, strip):
+
+        if not report(x0):
+            return None
+
+        x1 = min(x0 + strip, sw)
+        re = cx + cw*(np.arange(x0, x1)/sw)
+
+        z = (re[:,None] + 1j*im[None,:]).astype(dtype).ravel()
+        c = z.copy() if julia == None else np.full_like(z, julia)
+
+        idx = np.arange(c.size)
+        out = np.full(c.size, max_d - 1, dtype = np.int32)
+
+        for m in range(max_d):
+
+            z = z*z + c
+            esc = np.abs(z) >= 2.0
+
+            if esc.any():
+                out[idx[esc]] = m
+                keep = ~esc
+                idx = idx[keep]
+                z = z[keep]
+                c = c[keep]
+
+            if idx.size == 0: break
+
+        m_map.extend(out.reshape(x1 - x0, sh).tolist())
+
+    return m_map
+
+############################################################
+
+def Float32Kernel(view, sw, sh, max_d = MAX_DEPTH, progress = None, julia = None):
+
+    # NumPy kernel using single precision. Faster but only
+    # good for shallow views, so never chosen automatically.
+
+    return NumpyKernel(view, sw, sh, max_d, progress, julia, "complex64")
+
+############################################################
+
+def PreciseKernel(view, sw, sh, max_d = MAX_DEPTH, progress = None, julia = None):
+
+    # Exact fixed-point kernel (see MandelbrotPrecise). Much
+    # too slow to be chosen automatically. Julia sets are not
+    # supported: they need no such precision. Views are not
+    # kept in the reference cache.
+
+    if julia != None:
+        raise ValueError("The precise kernel does not calculate Julia sets")
+
+    from MandelbrotPrecise import CalcMapPrecise
+
+    return CalcMapPrecise(view, sw, sh, max_d, cache = None)
+
+############################################################
+
+RegisterKernel("python",  CalcMap)
+RegisterKernel("process", ProcessKernel, available = (os.cpu_count() or 1) > 1)
+RegisterKernel("numpy",   NumpyKernel, available = find_spec("numpy") != None)
+RegisterKernel("float32", Float32Kernel, auto = False, available = find_spec("numpy") != None)
+RegisterKernel("precise", PreciseKernel, auto = False)
+
+############################################################
+# START OF PROGRAM
+############################################################
+
+if __name__ == "__main__":
+
+    # Shows calibration timings and the kernel selected
+
+    p = argparse.ArgumentParser(description="Mandelbrot Kernels")
+    p.add_argument("--recalibrate", action="store_true",
+                   help="ignore cached timings")
+    Args = p.parse_args()
+
+    print("Kernels    = ", ", ".join(KERNELS))
+    print("-----------------------------------------------------------------")
+
+    if Args.recalibrate or LoadCalibration() == None:
+        Calibrate(verbose = True)
+    else:
+        for name, t in LoadCalibration().items():
+            print(format(name, "10s"), format(t*1000, "9.3f"), "ms")
+
+    print("-----------------------------------------------------------------")
+    print("Selected   = ", SelectKernel())
+
+############################################################
+# END OF PROGRAM
+############################################################
@@ -0,0 +1,255 @@
+############################################################
+#
+# Mandelbrot 1.0 Copyright (C) RVJ Callanan 2012
+#
+# This is FREE software, licensed under the GNU GPLv3
+# See: <http://www.gnu.org/licenses/>.
+#
+############################################################
+#
+# MANDELBROT PRECISE ENGINE
+#
+# An exact (but slow) alternative to CalcMap() for views whose
+# pixels are too close together for floating-point numbers,
+# i.e. widths below MIN_WIDTH. It is also the ground truth
+# against which faster engines can be checked:
+#
+#   python MandelbrotPrecise.py --view X Y W [--size 60 40]
+#
+# NOTE ABOUT FIXED-POINT ARITHMETIC
+#
+# Every number is held as a Python integer scaled by 2**bits,
+# so that multiplying two numbers is a plain integer multiply
+# followed by a shift right of bits. The number of bits grows
+# with zoom depth (see PreciseBits) so that there are always
+# GUARD_BITS more bits than needed to tell neighbouring pixels
+# apart. View coordinates are given as Decimal (or strings) so
+# that they are not rounded to floats on the way in. If gmpy2
+# is installed its faster integers are used instead.
+#
+# Views are split into tiles which are calculated in parallel
+# in a process pool. Finished maps are cached on disk, keyed
+# by view, size, depth and precision, so that a reference map
+# only ever needs to be calculated once.
+
+############################################################
+# IMPORTS
+############################################################
+
+import os, argparse, hashlib, time
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from decimal import Decimal
+from math import *
+from MandelbrotEngine import *
+
+try:
+    from gmpy2 import mpz
+except ImportError:
+    mpz = int
+
+############################################################
+# CONSTANTS
+############################################################
+
+MIN_BITS    = 64            # Min fixed-point fraction bits
+GUARD_BITS  = 32            # Bits beyond one pixel width
+TILE        = 64            # Tile width and height (pixels)
+CACHE_DIR   = "reference"   # Default disk cache directory
+
+############################################################
+# FUNCTIONS
+############################################################
+
+def PreciseBits(view, sw = SW):
+
+    # Returns the number of fixed-point fraction bits needed
+    # for a view at a resolution of sw pixels across
+
+    pixel = Fraction(Decimal(view[2])) / sw
+
+    return max(MIN_BITS, ceil(-log2(pixel)) + GUARD_BITS)
+
+############################################################
+
+def ToFixed(v, bits):
+
+    # Converts a Decimal, string or float to a fixed-point
+    # integer with the given number of fraction bits
+
+    return mpz(round(Fraction(Decimal(v)) * 2**bits))
+
+############################################################
+
+def CalcTile(view, sw, sh, x0, y0, x1, y1, max_d, bits):
+
+    # Runs in a worker process. Returns the Mandelbrot values
+    # of pixels x0..x1-1, y0..y1-1 of a view as a list of
+    # columns. Pixel coordinates are derived exactly as in
+    # CalcMap(): re = left + w*sx/sw and im = top - h*sy/sh.
+
+    w = ToFixed(view[2], bits)
+    h = ToFixed(view[3], bits)
+
+    left = ToFixed(view[0], bits) - w//2
+    top  = ToFixed(view[1], bits) + h//2
+
+    four = mpz(4) << (2*bits)
+
+    cols = []
+
+    for sx in range(x0, x1):
+
+        col = []
+        cr = left + w*sx//sw
+
+        for sy in range(y0, y1):
+
+            ci = top - h*sy//sh
+
+            zr = cr
+            zi = ci
+
+            for m in range(max_d):
+
+                zr, zi = ((zr*zr - zi*zi) >> bits) + cr, ((zr*zi) >> (bits-1)) + ci
+
+                if zr*zr + zi*zi >= four: break
+
+            col.append(m)
+
+        #endfor
+
+        cols.append(col)
+
+    #endfor
+
+    return cols
+
+############################################################
+
+def CalcMapPrecise(view, sw = SW, sh = SH, max_d = MAX_DEPTH,
+                   workers = None, cache = CACHE_DIR):
+
+    # Returns a map of Mandelbrot values for a view using
+    # exact fixed-point arithmetic. The view is split into
+    # tiles which are calculated in parallel by a pool of
+    # workers (one per CPU unless given). Maps are cached in
+    # the cache directory unless cache is None.
+
+    view = [Decimal(v) if isinstance(v, str) else v for v in view]
+
+    bits = PreciseBits(view, sw)
+
+    path = CachePath(view, sw, sh, max_d, bits, cache)
+
+    if path != None and os.path.exists(path):
+        return LoadMap(path)[0]
+
+    m_map = NewMap(sw, sh)
+
+    tiles = [(x0, y0, min(x0 + TILE, sw), min(y0 + TILE, sh))
+             for x0 in range(0, sw, TILE) for y0 in range(0, sh, TILE)]
+
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+
+        jobs = [pool.submit(CalcTile, view, sw, sh, *t, max_d, bits) for t in tiles]
+
+        for (x0, y0, x1, y1), job in zip(tiles, jobs):
+            for sx, col in enumerate(job.result(), x0):
+                m_map[sx][y0:y1] = col
+
+    if path != None:
+        os.makedirs(cache, exist_ok = True)
+        SaveMap(path, m_map, view, max_d)
+
+    return m_map
+
+############################################################
+
+def CachePath(view, sw, sh, max_d, bits, cache):
+
+    # Returns disk cache path for a reference map, or None if
+    # caching is disabled (no cache directory given)
+
+    if cache == None or cache == "":
+        return None
+
+    key = repr(([str(v) for v in view], sw, sh, max_d, bits)).encode("ascii")
+
+    return os.path.join(cache, hashlib.sha1(key).hexdigest() + ".map")
+
+############################################################
+
+def CompareMaps(m_map, ref_map, tolerance = 0):
+
+    # Compares a map against a reference map. Returns the
+    # number of pixels whose Mandelbrot values differ by more
+    # than tolerance, together with the largest difference.
+
+    bad = 0
+    worst = 0
+
+    for col, ref_col in zip(m_map, ref_map):
+        for m, r in zip(col, ref_col):
+            d = abs(m - r)
+            if d > tolerance: bad += 1
+            if d > worst: worst = d
+
+    return bad, worst
+
+############################################################
+
+def ParseArgs():
+
+    p = argparse.ArgumentParser(description="Mandelbrot Precise Engine")
+
+    p.add_argument("--view", nargs=3, type=Decimal, metavar=("X","Y","W"),
+                   default=[Decimal(str(v)) for v in WORLDVIEW[:3]])
+    p.add_argument("--size", nargs=2, type=int, metavar=("SW","SH"),
+                   default=[SW//10, SH//10])
+    p.add_argument("--depth", type=int, default=MAX_DEPTH)
+    p.add_argument("--workers", type=int, default=None)
+    p.add_argument("--cache", default=CACHE_DIR, metavar="DIR",
+                   help="reference map cache directory (\"\" to disable)")
+
+    return p.parse_args()
+
+############################################################
+# START OF PROGRAM
+############################################################
+
+if __name__ == "__main__":
+
+    # Calculates a reference map and compares the standard
+    # floating-point engine against it
+
+    Args = ParseArgs()
+
+    x,y,w = Args.view
+    sw,sh = Args.size
+
+    view = [x, y, w, w*sh/sw]
+
+    print("Center X = ", FmtDp(x, ViewDp(view, sw)))
+    print("Center Y = ", FmtDp(y, ViewDp(view, sw)))
+    print("Width    = ", FmtDp(w, ViewDp(view, sw)))
+    print("Bits     = ", PreciseBits(view, sw))
+    print("-----------------------------------------------------------------")
+
+    start = time.perf_counter()
+    ref_map = CalcMapPrecise(view, sw, sh, Args.depth, Args.workers, Args.cache)
+    print("Precise  = ", format(time.perf_counter() - start, ".3f"), "secs")
+
+    start = time.perf_counter()
+    m_map = CalcMap([float(v) for v in view], sw, sh, Args.depth)
+    print("Standard = ", format(time.perf_counter() - start, ".3f"), "secs")
+
+    bad, worst = CompareMaps(m_map, ref_map)
+
+    print("Differ   = ", bad, "of", sw*sh, "pixels (max difference " + str(worst) + ")")
+    print("-----------------------------------------------------------------")
+
+############################################################
+# END OF PROGRAM
+############################################################
@@ -0,0 +1,230 @@
+############################################################
+#
+# Mandelbrot 1.0 Copyright (C) RVJ Callanan 2012
+#
+# This is FREE software, licensed under the GNU GPLv3
+# See: <http://www.gnu.org/licenses/>.
+#
+############################################################
+#
+# MANDELBROT REPLAY
+#
+# Replays a session recorded with "Mandelbrot.py --record FILE"
+# without a real display (SDL_VIDEODRIVER=dummy) and reports
+# what the user would have felt at each step of the session:
+#
+#   python MandelbrotReplay.py FILE [--kernel NAME] [--fast]
+#
+# A step is the calculation of one view: the initial view and
+# then every zoom. For each step the report shows the drag
+# frame times of the zoom rectangle that led to it, the time
+# from the zoom click to the first display update showing the
+# new view (preview) and the time to the finished image
+# (final). Running the same recording before and after a
+# change gives an objective comparison.
+#
+# The viewer is set up as it was when recording: the same
+# depth, colors and options (--index, --prefetch, --resume and
+# --adaptive), and the same kernel unless another is given.
+# The view window size cannot be changed, so recordings made
+# at another size are refused.
+#
+# Events are posted by a timer thread after the user's
+# recorded idle time (unless --fast), while the viewer waits
+# for them in its own GetEvent() loop. So prefetching, Julia
+# panel refinement and zoom previews go on meanwhile just as
+# they did live. Events which arrived while the viewer was
+# still busy are posted together so that they are coalesced
+# exactly as they were.
+
+############################################################
+# IMPORTS
+############################################################
+
+import os, time, json, argparse, threading
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import Mandelbrot as Viewer
+from MandelbrotKernels import SelectKernel, KERNELS, VECTORISED
+
+############################################################
+# FUNCTIONS
+############################################################
+
+def LoadTrace(filename):
+
+    # Returns the header and list of events of a recording
+
+    with open(filename) as f:
+        lines = [json.loads(line) for line in f if line.strip() != ""]
+
+    if len(lines) == 0 or "view" not in lines[0]:
+        raise ValueError("Not a Mandelbrot recording: " + filename)
+
+    return lines[0], lines[1:]
+
+############################################################
+
+def MakeEvent(rec):
+
+    # Converts a recorded event back into a Pygame event
+
+    pygame = Viewer.pygame
+
+    attrs = {}
+
+    for attr in ["pos", "button", "key"]:
+        if attr in rec:
+            attrs[attr] = tuple(rec[attr]) if attr == "pos" else rec[attr]
+
+    return pygame.event.Event(getattr(pygame, rec["type"]), attrs)
+
+############################################################
+
+def PostEvents(events, posted):
+
+    # Posts events to the viewer together (from a timer
+    # thread) and then sets posted
+
+    for event in events:
+        Viewer.pygame.event.post(event)
+
+    posted.set()
+
+############################################################
+
+def Replay(filename, kernel = None, fast = False):
+
+    # Replays a recording through the viewer and returns the
+    # viewer's list of step timings
+
+    header, events = LoadTrace(filename)
+
+    if header.get("size", [Viewer.SW, Viewer.SH]) != [Viewer.SW, Viewer.SH]:
+        raise ValueError("Recorded at a view window size of %d x %d, not %d x %d" %
+                         (*header["size"], Viewer.SW, Viewer.SH))
+
+    Viewer.ViewRect    = header["view"]
+    Viewer.Depth       = header.get("depth", Viewer.Depth)
+    Viewer.Mapping     = header.get("mapping", Viewer.Mapping)
+    Viewer.Gradient    = header.get("gradient", Viewer.Gradient)
+    Viewer.Clip        = header.get("clip", Viewer.Clip)
+    Viewer.Indexed     = header.get("index", False)
+    Viewer.Prefetching = header.get("prefetch", False)
+    Viewer.Resumable   = header.get("resume", False)
+    Viewer.Adaptive    = header.get("adaptive", False)
+
+    if kernel == None and header.get("kernel") in KERNELS:
+        kernel = header["kernel"]
+
+    Viewer.Kernel      = SelectKernel(kernel)
+
+    if Viewer.Kernel in VECTORISED:
+        Viewer.Adaptive = False
+
+    Viewer.Steps.clear()
+
+    Viewer.InitViewVars()
+    Viewer.InitViewWindow()
+
+    pygame = Viewer.pygame
+
+    types = [getattr(pygame, e) for e in Viewer.ALL_EVENTS]
+
+    Viewer.StartStep()
+    Viewer.Calc()
+    Viewer.Draw()
+    Viewer.MarkTime("final")
+
+    i = 0
+
+    while i < len(events) and not Viewer.Closing:
+
+        # Post this event, and any that followed it while the
+        # viewer was busy, once the user's idle time is up
+
+        delay = 0.0 if fast else events[i]["gap"] - (time.perf_counter() - Viewer.IdleSince)
+
+        batch = [MakeEvent(events[i])]
+        i += 1
+
+        while i < len(events) and events[i]["gap"] <= 0.0:
+            batch.append(MakeEvent(events[i]))
+            i += 1
+
+        posted = threading.Event()
+
+        threading.Timer(max(0.0, delay), PostEvents, [batch, posted]).start()
+
+        # Meanwhile the viewer waits and does its idle work as
+        # usual, until the events have been handled
+
+        while not Viewer.Closing and not (posted.is_set() and not pygame.event.peek(types)):
+            Viewer.GetEvent()
+
+    pygame.quit()
+
+    return Viewer.Steps
+
+############################################################
+
+def Report(steps):
+
+    # Prints step timings in milliseconds
+
+    print("-----------------------------------------------------------------")
+    print("Step  Width        Frames  Mean(ms)  Max(ms)  Preview(ms)  Final(ms)")
+    print("-----------------------------------------------------------------")
+
+    for n, step in enumerate(steps):
+
+        ms = [t*1000 for t in step["frames"]]
+
+        mean = format(sum(ms)/len(ms), "8.3f") if len(ms) > 0 else "       -"
+        top  = format(max(ms), "7.3f") if len(ms) > 0 else "      -"
+
+        preview = format(step["preview"]*1000, "11.1f") if "preview" in step else "          -"
+        final   = format(step["final"]*1000, "9.1f") if "final" in step else "        -"
+
+        print(format(n, "4d"), "", format(step["view"][2], "<11.4g"),
+              format(len(ms), "6d"), "", mean, "", top, "", preview, "", final)
+
+    print("-----------------------------------------------------------------")
+
+############################################################
+
+def ParseArgs():
+
+    p = argparse.ArgumentParser(description="Mandelbrot Replay")
+
+    p.add_argument("trace", metavar="FILE",
+                   help="recording made with Mandelbrot.py --record")
+    p.add_argument("--kernel", choices=list(KERNELS),
+                   help="kernel to replay with (default: as recorded)")
+    p.add_argument("--fast", action="store_true",
+                   help="do not wait for recorded idle times")
+    p.add_argument("--json", metavar="FILE",
+                   help="also write step timings to a JSON file")
+
+    return p.parse_args()
+
+############################################################
+# START OF PROGRAM
+############################################################
+
+if __name__ == "__main__":
+
+    Args = ParseArgs()
+
+    Steps = Replay(Args.trace, Args.kernel, Args.fast)
+
+    Report(Steps)
+
+    if Args.json != None:
+        with open(Args.json, "w") as f:
+            json.dump(Steps, f, indent = 1)
+
+############################################################
+# END OF PROGRAM
+############################################################
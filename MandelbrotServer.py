@@ -0,0 +1,421 @@
+############################################################
+#
+# Mandelbrot 1.0 Copyright (C) RVJ Callanan 2012
+#
+# This is FREE software, licensed under the GNU GPLv3
+# See: <http://www.gnu.org/licenses/>.
+#
+############################################################
+#
+# MANDELBROT TILE SERVER
+#
+# Serves the Mandelbrot Set as square PNG tiles so that it can
+# be browsed with a web map viewer (slippy map) instead of the
+# fixed size view window. Run it and open the printed address
+# in a browser:
+#
+#   python MandelbrotServer.py [--port 8080] [--depth 256]
+#
+# NOTE ABOUT TILES
+#
+# Tiles are addressed as /z/x/y.png using the quadtree of the
+# engine's TileView().
+#
+# NOTE ABOUT COLORS
+#
+# BalancePalette() balances colors for one view at a time,
+# which would make neighbouring tiles clash. Instead, a single
+# palette is balanced once at start-up from a reference view
+# (the WORLDVIEW unless --reference is given) and used for
+# every tile. Tiles are rendered on demand in a process pool.
+# Their Mandelbrot values and PNG images are kept in an LRU
+# memory cache backed by a disk cache. Concurrent requests for
+# the same tile share a single render.
+#
+# With --adaptive each part of a tile is only calculated as
+# deep as it needs, up to --depth (see MandelbrotAdaptive),
+# and pixels inside the set keep the value of --depth, so the
+# shared palette still colors every tile alike.
+
+############################################################
+# IMPORTS
+############################################################
+
+import os, argparse, asyncio, hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from math import *
+from MandelbrotEngine import *
+from MandelbrotKernels import GetKernel, SelectKernel, KERNELS, VECTORISED
+from MandelbrotAdaptive import CalcMapAdaptive
+
+############################################################
+# CONSTANTS
+############################################################
+
+TILE        = 256           # Tile width and height (pixels)
+MAX_ZOOM    = floor(log2(MAX_WIDTH * SW / (MIN_WIDTH * TILE)))
+
+CACHE_TILES = 512           # Max tiles in memory cache
+CACHE_DIR   = "tiles"       # Default disk cache directory
+
+PORT        = 8080          # Default port on localhost
+
+INDEX_HTML  = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Mandelbrot</title>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css">
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>html,body,#map{height:100%%;margin:0;background:#fff}</style>
+</head><body><div id="map"></div><script>
+var map = L.map("map", {crs: L.CRS.Simple, minZoom: 0, maxZoom: %d});
+L.tileLayer("/{z}/{x}/{y}.png", {tileSize: %d, noWrap: true,
+    bounds: [[-%d, 0], [0, %d]], maxZoom: %d}).addTo(map);
+map.setView([-%d, %d], 1);
+</script></body></html>
+"""
+
+############################################################
+# Global Variables
+############################################################
+
+Depth       = MAX_DEPTH     # Max Mandelbrot iterations for tiles
+Kernel      = "python"      # Kernel used to calculate tiles
+Adaptive    = False         # Depth is the cap of each tile's own depth
+Palette     = None          # Palette shared by all tiles
+PaletteKey  = None          # Short hash identifying Palette
+CacheDir    = CACHE_DIR     # Disk cache directory
+Cache       = None          # Memory cache of (data, png) by tile
+Pending     = None          # Tiles currently being rendered
+Pool        = None          # Process pool for rendering tiles
+
+############################################################
+# FUNCTIONS
+############################################################
+
+def ValidTile(z, x, y):
+
+    # Returns True if tile address lies within the quadtree
+
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2**z and 0 <= y < 2**z
+
+############################################################
+
+def RenderTile(z, x, y, max_d, palette, kernel, adaptive = False):
+
+    # Runs in a worker process. Calculates the Mandelbrot
+    # values of a tile, at the depth needed by each part of
+    # it up to max_d if adaptive, and colors them with the
+    # shared palette. Returns the values as a compact array
+    # and the image as PNG bytes.
+
+    if adaptive:
+        m_map = CalcMapAdaptive(TileView(z,x,y), TILE, TILE, max_d, None, GetKernel(kernel))
+    else:
+        m_map = GetKernel(kernel)(TileView(z,x,y), TILE, TILE, max_d)
+
+    return MapToArray(m_map), PngBytes(RenderBytes(m_map, palette), TILE, TILE)
+
+############################################################
+
+def InitSharedPalette(args):
+
+    # Balances the shared palette once from a low resolution
+    # render of the reference view
+
+    global Palette, PaletteKey
+
+    if args.reference != None:
+        x,y,w = args.reference
+        view = [x, y, w, w/AR]
+    else:
+        view = WORLDVIEW
+
+    m_map = CalcMap(view, SW//4, SH//4, Depth)
+
+    Palette = MakePalette(m_map, args.mapping, args.gradient, args.clip, Depth)
+
+    lut = b"".join([bytes(entry[1]) for entry in Palette])
+    PaletteKey = hashlib.sha1(lut).hexdigest()[:12]
+
+############################################################
+
+def TilePath(z, x, y, ext):
+
+    # Returns disk cache path of a tile's values (.map) or
+    # image (.png). Values depend on the kernel (which may be
+    # less precise) and the depth (and whether it is
+    # adaptive), images also on the palette.
+
+    depth = os.path.join(Kernel, ("a%d" if Adaptive else "d%d") % Depth)
+
+    if ext == "map":
+        sub = depth
+    else:
+        sub = os.path.join(depth, PaletteKey)
+
+    return os.path.join(CacheDir, sub, str(z), str(x), "%d.%s" % (y, ext))
+
+############################################################
+
+def CacheGet(key):
+
+    # Returns (data, png) for a tile from the memory cache or,
+    # failing that, the disk cache. Returns None if the tile
+    # has not been rendered yet. Images missing from the disk
+    # cache (e.g. after a palette change) are recolored from
+    # the cached values without recalculating.
+
+    if key in Cache:
+        Cache.move_to_end(key)
+        return Cache[key]
+
+    map_path = TilePath(*key, "map")
+
+    if not os.path.exists(map_path):
+        return None
+
+    m_map, view, max_d = LoadMap(map_path)
+
+    png_path = TilePath(*key, "png")
+
+    if os.path.exists(png_path):
+        with open(png_path, "rb") as f:
+            png = f.read()
+    else:
+        png = PngBytes(RenderBytes(m_map, Palette), TILE, TILE)
+        WriteFile(png_path, png)
+
+    CachePut(key, MapToArray(m_map), png)
+
+    return Cache[key]
+
+############################################################
+
+def CachePut(key, data, png):
+
+    # Adds tile to memory cache, evicting least recently
+    # used tiles if the cache is full
+
+    Cache[key] = (data, png)
+    Cache.move_to_end(key)
+
+    while len(Cache) > CACHE_TILES:
+        Cache.popitem(last = False)
+
+############################################################
+
+def WriteFile(path, data):
+
+    # Writes bytes to a cache file, creating directories as
+    # needed. Writes to a temporary file first so that a
+    # partly written file is never left in the cache.
+
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+
+    tmp = path + ".tmp"
+
+    with open(tmp, "wb") as f:
+        f.write(data)
+
+    os.replace(tmp, path)
+
+############################################################
+
+async def MakeTile(key):
+
+    # Renders a tile in the process pool and adds it to the
+    # memory and disk caches
+
+    loop = asyncio.get_running_loop()
+
+    data, png = await loop.run_in_executor(Pool, RenderTile, *key, Depth, Palette, Kernel, Adaptive)
+
+    map_path = TilePath(*key, "map")
+
+    os.makedirs(os.path.dirname(map_path), exist_ok = True)
+    SaveMap(map_path + ".tmp", MapFromArray(data, TILE, TILE), TileView(*key), Depth)
+    os.replace(map_path + ".tmp", map_path)
+
+    WriteFile(TilePath(*key, "png"), png)
+
+    CachePut(key, data, png)
+
+    return png
+
+############################################################
+
+async def GetTile(key):
+
+    # Returns PNG bytes for a tile. Concurrent requests for a
+    # tile that is already being rendered wait for that render
+    # rather than starting another one. The render is shielded
+    # so that one client disconnecting does not cancel it for
+    # the others.
+
+    cached = CacheGet(key)
+
+    if cached != None:
+        return cached[1]
+
+    task = Pending.get(key)
+
+    if task == None:
+        task = asyncio.ensure_future(MakeTile(key))
+        Pending[key] = task
+        task.add_done_callback(lambda t: Pending.pop(key, None))
+
+    return await asyncio.shield(task)
+
+############################################################
+
+def ParsePath(path):
+
+    # Returns (z,x,y) for a tile path /z/x/y.png or None
+
+    parts = path.split("?")[0].strip("/").split("/")
+
+    if len(parts) != 3 or not parts[2].endswith(".png"):
+        return None
+
+    try:
+        key = (int(parts[0]), int(parts[1]), int(parts[2][:-4]))
+    except ValueError:
+        return None
+
+    return key if ValidTile(*key) else None
+
+############################################################
+
+def IndexHtml():
+
+    # Returns a minimal Leaflet page for browsing the tiles
+
+    return (INDEX_HTML % (MAX_ZOOM, TILE, TILE, TILE, MAX_ZOOM,
+                          TILE//2, TILE//2)).encode("utf-8")
+
+############################################################
+
+async def HandleClient(reader, writer):
+
+    # Handles a single HTTP GET request and closes the
+    # connection. Only tiles and the index page are served.
+
+    try:
+
+        request = (await reader.readline()).decode("latin-1").split()
+
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+
+        if len(request) < 2 or request[0] != "GET":
+            status, ctype, body = "405 Method Not Allowed", "text/plain", b""
+
+        elif request[1] in ("/", "/index.html"):
+            status, ctype, body = "200 OK", "text/html", IndexHtml()
+
+        else:
+            key = ParsePath(request[1])
+
+            if key == None:
+                status, ctype, body = "404 Not Found", "text/plain", b""
+            else:
+                try:
+                    status, ctype, body = "200 OK", "image/png", await GetTile(key)
+                except Exception as e:
+                    print("Tile", key, "failed:", repr(e))
+                    status, ctype, body = "500 Internal Server Error", "text/plain", b""
+
+        writer.write(("HTTP/1.1 %s\r\nContent-Type: %s\r\n"
+                      "Content-Length: %d\r\nConnection: close\r\n\r\n"
+                      % (status, ctype, len(body))).encode("latin-1") + body)
+
+        await writer.drain()
+
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+
+    finally:
+        writer.close()
+
+############################################################
+
+async def Serve(host, port):
+
+    server = await asyncio.start_server(HandleClient, host, port)
+
+    print("Serving tiles on http://%s:%d/" % (host, port))
+    print("-----------------------------------------------------------------")
+
+    async with server:
+        await server.serve_forever()
+
+############################################################
+
+def ParseArgs():
+
+    p = argparse.ArgumentParser(description="Mandelbrot Tile Server")
+
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=PORT)
+    p.add_argument("--depth", type=int, default=MAX_DEPTH,
+                   help="max Mandelbrot iterations for every tile")
+    p.add_argument("--adaptive", action="store_true",
+                   help="choose the depth of each part of a tile, up to --depth"
+                        " (not with vectorised kernels)")
+    p.add_argument("--kernel", choices=list(KERNELS),
+                   help="force kernel (default: fastest calibrated)")
+    p.add_argument("--workers", type=int, default=None,
+                   help="render processes (default: one per CPU)")
+    p.add_argument("--cache", default=CACHE_DIR, metavar="DIR",
+                   help="disk cache directory")
+    p.add_argument("--reference", nargs=3, type=float, metavar=("X","Y","W"),
+                   help="view used to balance the shared palette")
+    p.add_argument("--mapping", choices=MAPPINGS, default="CLIP")
+    p.add_argument("--gradient", choices=GRADIENTS, default="GREY")
+    p.add_argument("--clip", type=float, default=CLIP, metavar="PERCENT")
+
+    return p.parse_args()
+
+############################################################
+# START OF PROGRAM
+############################################################
+
+if __name__ == "__main__":
+
+    print("Mandelbrot Tile Server 1.0 Copyright (C) RVJ Callanan")
+    print("This is FREE software released under the GPLv3")
+    print()
+
+    Args = ParseArgs()
+
+    Depth    = Args.depth
+    CacheDir = Args.cache
+
+    # Tiles are already spread across processes so the
+    # "process" kernel would only add overhead
+
+    Kernel   = SelectKernel(Args.kernel, exclude = ["process"])
+
+    # Vectorised kernels already stop working on escaped
+    # pixels and only lose by being run a part at a time
+
+    Adaptive = Args.adaptive and Kernel not in VECTORISED
+
+    if Args.adaptive and not Adaptive:
+        print("Adaptive depth is not used with the " + Kernel + " kernel")
+        print()
+
+    Cache    = OrderedDict()
+    Pending  = {}
+
+    InitSharedPalette(Args)
+
+    with ProcessPoolExecutor(max_workers = Args.workers) as Pool:
+        try:
+            asyncio.run(Serve(Args.host, Args.port))
+        except KeyboardInterrupt:
+            pass
+
+############################################################
+# END OF PROGRAM
+############################################################